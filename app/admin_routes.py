@@ -1,25 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional
-from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 
-from . import models, database, auth, schemas
-from .database import get_db
-
-# Create a dependency that will check for admin role
-def admin_dependency(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    user = auth.get_current_user_sync(token, db)
-    if not user.is_active:
-        raise HTTPException(status_code=400, detail="Inactive user")
-    if user.role != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized. Admin role required."
-        )
-    return user
+from . import models, auth, counters, fragments, themes, assets, instrumentation, profiling
+from .database import get_async_db
 
 router = APIRouter(
     prefix="/admin",
@@ -28,28 +14,31 @@ router = APIRouter(
 )
 
 templates = Jinja2Templates(directory="app/templates")
+instrumentation.instrument_templates(templates.env)
+templates.env.globals.update(themes.template_globals())
+templates.env.globals["static_url"] = assets.static_url
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def admin_dashboard(
     request: Request, 
-    current_user: models.User = Depends(admin_dependency),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Admin dashboard showing system statistics and management options."""
-    # Get user count
-    user_count = db.query(models.User).count()
-    
-    # Get book count
-    book_count = db.query(models.Book).count()
-    
-    # Get counts by status
-    status_counts = {}
-    for status in ['to_read', 'reading', 'completed', 'on_hold', 'dnf']:
-        count = db.query(models.Book).filter(models.Book.status == status).count()
-        status_counts[status] = count
+    # Read the incrementally maintained counters instead of counting rows
+    counts = await db.run_sync(counters.get_counts)
+    user_count = counts[counters.USERS]
+    status_counts = {
+        status: counts[counters.book_counter(status)]
+        for status in counters.BOOK_STATUSES
+    }
+    book_count = sum(status_counts.values())
     
     # Get recent users
-    recent_users = db.query(models.User).order_by(models.User.created_at.desc()).limit(5).all()
+    result = await db.execute(
+        select(models.User).order_by(models.User.created_at.desc()).limit(5)
+    )
+    recent_users = result.scalars().all()
     
     return templates.TemplateResponse(
         "admin/dashboard.html",
@@ -61,17 +50,28 @@ async def admin_dashboard(
             "book_count": book_count,
             "status_counts": status_counts,
             "recent_users": recent_users,
+            "profiles": profiling.profiles.recent(),
         }
     )
 
+@router.post("/counters/reconcile")
+async def reconcile_counters(
+    current_user: models.User = Depends(auth.get_current_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Recount users and books and repair any drift in the dashboard counters."""
+    drift = await db.run_sync(counters.reconcile)
+    return {"success": True, "drift": drift}
+
 @router.get("/users", response_class=HTMLResponse)
 async def list_users(
     request: Request, 
-    current_user: models.User = Depends(auth.get_current_admin_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all users in the system."""
-    users = db.query(models.User).all()
+    result = await db.execute(select(models.User))
+    users = result.scalars().all()
     return templates.TemplateResponse(
         "admin/users.html",
         {
@@ -85,11 +85,11 @@ async def list_users(
 @router.post("/users/{user_id}/toggle-role")
 async def toggle_user_role(
     user_id: int,
-    current_user: models.User = Depends(auth.get_current_admin_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Toggle a user's role between 'user' and 'admin'."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -99,18 +99,20 @@ async def toggle_user_role(
     
     # Toggle role
     user.role = "admin" if user.role == "user" else "user"
-    db.commit()
+    await db.commit()
+    # Make the new role apply to the user's very next request
+    auth.identity_cache.invalidate_user(user.id)
     
     return {"success": True, "role": user.role}
 
 @router.post("/users/{user_id}/toggle-active")
 async def toggle_user_active(
     user_id: int,
-    current_user: models.User = Depends(auth.get_current_admin_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Toggle a user's active status."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -120,31 +122,39 @@ async def toggle_user_active(
     
     # Toggle active status
     user.is_active = not user.is_active
-    db.commit()
+    await db.commit()
+    # Don't let cached identities keep a deactivated user signed in
+    auth.identity_cache.invalidate_user(user.id)
     
     return {"success": True, "is_active": user.is_active}
 
 @router.get("/stats", response_class=HTMLResponse)
 async def system_stats(
     request: Request, 
-    current_user: models.User = Depends(auth.get_current_admin_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """System statistics page."""
     # Get total books by user
-    user_book_counts = db.query(
-        models.User.email, 
-        models.User.id,
-        func.count(models.Book.id).label('book_count')
-    ).outerjoin(models.Book).group_by(models.User.id).all()
+    result = await db.execute(
+        select(
+            models.User.email, 
+            models.User.id,
+            func.count(models.Book.id).label('book_count')
+        ).outerjoin(models.Book).group_by(models.User.id)
+    )
+    user_book_counts = result.all()
     
     # Get most read authors
-    top_authors = db.query(
-        models.Book.author,
-        func.count(models.Book.id).label('book_count')
-    ).filter(models.Book.author != None).group_by(models.Book.author).order_by(
-        func.count(models.Book.id).desc()
-    ).limit(10).all()
+    result = await db.execute(
+        select(
+            models.Book.author,
+            func.count(models.Book.id).label('book_count')
+        ).filter(models.Book.author != None).group_by(models.Book.author).order_by(
+            func.count(models.Book.id).desc()
+        ).limit(10)
+    )
+    top_authors = result.all()
     
     return templates.TemplateResponse(
         "admin/stats.html",
@@ -154,5 +164,31 @@ async def system_stats(
             "user": current_user,  # Add this for the base template
             "user_book_counts": user_book_counts,
             "top_authors": top_authors,
+            "fragment_cache": fragments.fragment_cache.stats(),
         }
     )
+
+def render_profile(request: Request, profile: profiling.Profile, current_user: models.User):
+    """The report page of a profiled request."""
+    return templates.TemplateResponse(
+        "admin/profile.html",
+        {
+            "request": request,
+            "current_user": current_user,
+            "user": current_user,  # Add this for the base template
+            "profile": profile,
+        },
+        headers={"Cache-Control": "no-store"},
+    )
+
+@router.get("/profiles/{profile_id}", response_class=HTMLResponse)
+async def view_profile(
+    request: Request,
+    profile_id: int,
+    current_user: models.User = Depends(auth.get_current_admin_user_async)
+):
+    """A profile from the recent profiles buffer."""
+    profile = profiling.profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found, it may have been evicted")
+    return render_profile(request, profile, current_user)
@@ -0,0 +1,104 @@
+"""Fingerprinted URLs for the files under app/static.
+
+Every static file is hashed on startup and templates link to it as
+``/static/<name>.<hash>.<ext>`` through the ``static_url`` helper. A
+fingerprinted URL changes whenever the file does, so it is served with
+``Cache-Control: immutable`` and browsers never have to revalidate it.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+from typing import Dict, Optional
+
+from .compression import PRECOMPRESSED_SUFFIXES, PrecompressedStaticFiles
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIRECTORY = "app/static"
+STATIC_URL_PREFIX = "/static/"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def fingerprint_file(path: str) -> str:
+    """Short hash of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def fingerprinted_name(path: str, fingerprint: str) -> str:
+    """Insert a fingerprint before the extension: css/app.css -> css/app.<hash>.css"""
+    root, extension = posixpath.splitext(path)
+    return f"{root}.{fingerprint}{extension}"
+
+
+class AssetManifest:
+    """Maps static file paths to their fingerprinted names and back."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.fingerprinted: Dict[str, str] = {}
+        self.originals: Dict[str, str] = {}
+        # Hash over all the fingerprints, which changes whenever any file does
+        self.fingerprint = ""
+
+    def build(self) -> int:
+        """Hash every file in the directory, replacing the previous mapping.
+
+        Returns:
+            int: The number of files hashed
+        """
+        fingerprinted = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(tuple(PRECOMPRESSED_SUFFIXES.values())):
+                    continue
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                fingerprinted[path] = fingerprinted_name(path, fingerprint_file(full_path))
+        self.fingerprinted = fingerprinted
+        self.originals = {name: path for path, name in fingerprinted.items()}
+        self.fingerprint = hashlib.sha256(
+            "\n".join(sorted(self.originals)).encode()
+        ).hexdigest()[:16]
+        logger.info(f"Fingerprinted {len(fingerprinted)} static files in {self.directory}")
+        return len(fingerprinted)
+
+    def url(self, path: str) -> str:
+        """The fingerprinted URL of a static file, or its plain URL if it is unknown."""
+        return STATIC_URL_PREFIX + self.fingerprinted.get(path, path)
+
+    def original(self, name: str) -> Optional[str]:
+        """The path of the file a fingerprinted name refers to, if it is one."""
+        return self.originals.get(name)
+
+
+static_assets = AssetManifest(STATIC_DIRECTORY)
+
+
+def static_url(path: str) -> str:
+    """Jinja helper resolving a path under app/static to its fingerprinted URL."""
+    return static_assets.url(path)
+
+
+class FingerprintedStaticFiles(PrecompressedStaticFiles):
+    """Serves fingerprinted names as their file, with far-future immutable caching.
+
+    Plain names are served as before, with the usual revalidation.
+    """
+
+    def __init__(self, *, manifest: AssetManifest, **kwargs):
+        super().__init__(**kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path, scope):
+        original = self.manifest.original(path.replace(os.sep, "/"))
+        if original is None:
+            return await super().get_response(path, scope)
+        response = await super().get_response(original, scope)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -1,12 +1,22 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from . import models, database
+from . import models, database, metrics
 
 # JWT configuration
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # In production, use a proper secret key from environment variables
@@ -19,6 +29,27 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# bcrypt pool: async routes hash on these threads instead of the event loop
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# Hash requests allowed to wait or run at once before new ones are turned away
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+
+hash_executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="bcrypt")
+hash_pending = 0
+
+hash_queue_seconds = metrics.REGISTRY.histogram(
+    "password_hash_queue_seconds", "Time password hashes wait for a pool thread", ["operation"]
+)
+hash_seconds = metrics.REGISTRY.histogram(
+    "password_hash_seconds", "Time spent running bcrypt", ["operation"]
+)
+hash_pending_gauge = metrics.REGISTRY.gauge(
+    "password_hash_pending", "Password hashes waiting for or running on the pool"
+)
+hash_rejected = metrics.REGISTRY.counter(
+    "password_hash_rejected_total", "Password hashes refused because the pool queue was full", ["operation"]
+)
+
 def verify_password(plain_password, hashed_password):
     """Verify a password against a hash."""
     return pwd_context.verify(plain_password, hashed_password)
@@ -27,6 +58,44 @@ def get_password_hash(password):
     """Hash a password for storing."""
     return pwd_context.hash(password)
 
+async def run_in_hash_pool(operation: str, func, *args):
+    """Run a bcrypt call on the hashing pool, or fail fast with 503 if it is saturated."""
+    global hash_pending
+    if hash_pending >= HASH_QUEUE_LIMIT:
+        hash_rejected.inc(operation=operation)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    queued_at = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        hash_queue_seconds.observe(started - queued_at, operation=operation)
+        try:
+            return func(*args)
+        finally:
+            hash_seconds.observe(time.perf_counter() - started, operation=operation)
+
+    # Only touched from the event loop, so no lock is needed
+    hash_pending += 1
+    hash_pending_gauge.set(hash_pending)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, timed)
+    finally:
+        hash_pending -= 1
+        hash_pending_gauge.set(hash_pending)
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verify a password against a hash without blocking the event loop."""
+    return await run_in_hash_pool("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """Hash a password for storing without blocking the event loop."""
+    return await run_in_hash_pool("hash", get_password_hash, password)
+
 def authenticate_user(db: Session, email: str, password: str):
     """Authenticate a user by email and password."""
     user = db.query(models.User).filter(models.User.email == email).first()
@@ -36,6 +105,20 @@ def authenticate_user(db: Session, email: str, password: str):
         return False
     return user
 
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    """Look up a user by email on an async session."""
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    """Async version of authenticate_user."""
+    user = await get_user_by_email_async(db, email)
+    if not user:
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    return user
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -49,6 +132,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_token_from_cookie(request: Request):
     """Extract token from cookie."""
+    return token_from_cookie(request)
+
+def token_from_cookie(request: Request):
+    """Synchronous version of get_token_from_cookie."""
     token = request.cookies.get("access_token")
     if not token:
         return None
@@ -57,78 +144,166 @@ async def get_token_from_cookie(request: Request):
         token = token[7:]
     return token
 
-def get_optional_current_user_sync(token: str, db: Session):
-    """Synchronous version of get_optional_current_user."""
-    if not token:
+# Verified tokens map to user snapshots for this long, so most requests skip
+# the users query. Admin changes to a user invalidate their entries at once.
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "30"))
+
+identity_cache_hits = metrics.REGISTRY.counter(
+    "identity_cache_hits_total", "Authenticated requests served from the identity cache"
+)
+identity_cache_misses = metrics.REGISTRY.counter(
+    "identity_cache_misses_total", "Authenticated requests that had to look up the user"
+)
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """The fields of a user that request handlers and templates read."""
+    id: int
+    email: str
+    role: str
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "UserSnapshot":
+        return cls(user.id, user.email, user.role, user.is_active, user.created_at)
+
+class IdentityCache:
+    """Per-process LRU cache of verified access tokens to user snapshots."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple[float, UserSnapshot]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[UserSnapshot]:
+        """Return the cached user for a token, if it has not expired."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(token)
+                identity_cache_hits.inc()
+                return entry[1]
+            if entry is not None:
+                del self._entries[token]
+        identity_cache_misses.inc()
         return None
-    
+
+    def remember(self, token: str, user: models.User, token_expires_at: Optional[float] = None) -> UserSnapshot:
+        """Cache a snapshot of the user a token was verified for and return it."""
+        snapshot = UserSnapshot.from_user(user)
+        expires_at = time.time() + self.ttl
+        # Never keep a token around longer than it is valid
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        with self._lock:
+            self._entries[token] = (expires_at, snapshot)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    def discard(self, token: str) -> None:
+        """Forget a single token, e.g. on logout."""
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Forget every token of a user whose role or active flag changed."""
+        with self._lock:
+            for token in [token for token, (_, user) in self._entries.items() if user.id == user_id]:
+                del self._entries[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+identity_cache = IdentityCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)
+
+def decode_token(token: str):
+    """Verify a token and return the email it was issued for and its expiry time."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        user = db.query(models.User).filter(models.User.email == email).first()
-        return user
     except JWTError:
+        return None, None
+    return payload.get("sub"), payload.get("exp")
+
+def resolve_user_sync(token: str, db: Session) -> Optional[UserSnapshot]:
+    """Get the user a token belongs to, from the identity cache when possible."""
+    if not token:
         return None
+    user = identity_cache.get(token)
+    if user is not None:
+        return user
 
-async def get_optional_current_user(request: Request = None, db: Session = Depends(database.get_db)):
-    """Get the current user from a JWT token in cookie, or None if not authenticated."""
-    if not request:
+    email, expires_at = decode_token(token)
+    if email is None:
         return None
-    
-    token = await get_token_from_cookie(request)
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if user is None:
+        return None
+    return identity_cache.remember(token, user, expires_at)
+
+async def resolve_user_async(token: str, db: AsyncSession) -> Optional[UserSnapshot]:
+    """Async version of resolve_user_sync."""
     if not token:
         return None
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        user = db.query(models.User).filter(models.User.email == email).first()
+    user = identity_cache.get(token)
+    if user is not None:
         return user
-    except JWTError:
+
+    email, expires_at = decode_token(token)
+    if email is None:
+        return None
+    user = await get_user_by_email_async(db, email)
+    if user is None:
         return None
+    return identity_cache.remember(token, user, expires_at)
 
-def get_current_user_sync(token: str, db: Session):
-    """Synchronous version of get_current_user."""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def get_optional_current_user_sync(token: str, db: Session):
+    """Synchronous version of get_optional_current_user."""
+    return resolve_user_sync(token, db)
+
+def get_optional_current_user(request: Request = None, db: Session = Depends(database.get_db)):
+    """Get the current user from a JWT token in cookie, or None if not authenticated.
+
+    A plain def, so FastAPI runs it in the threadpool: on an identity cache
+    miss it queries the users table through the sync session.
+    """
+    if not request:
+        return None
     
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        user = db.query(models.User).filter(models.User.email == email).first()
-        if user is None:
-            raise credentials_exception
-        return user
-    except JWTError:
-        raise credentials_exception
+    token = token_from_cookie(request)
+    return resolve_user_sync(token, db)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    """Get the current user from a JWT token."""
-    credentials_exception = HTTPException(
+def get_credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = db.query(models.User).filter(models.User.email == email).first()
+
+def get_current_user_sync(token: str, db: Session):
+    """Synchronous version of get_current_user."""
+    user = resolve_user_sync(token, db)
+    if user is None:
+        raise get_credentials_exception()
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    """Get the current user from a JWT token, in the threadpool like get_optional_current_user."""
+    user = resolve_user_sync(token, db)
+    if user is None:
+        raise get_credentials_exception()
+    return user
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
+    """Get the current user from a JWT token without blocking the event loop."""
+    user = await resolve_user_async(token, db)
     if user is None:
-        raise credentials_exception
+        raise get_credentials_exception()
     return user
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
@@ -148,6 +323,30 @@ async def get_current_admin_user(current_user: models.User = Depends(get_current
         )
     return current_user
 
+async def get_current_admin_user_async(current_user: models.User = Depends(get_current_user_async)):
+    """Async version of get_current_admin_user."""
+    if not current_user.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized. Admin role required."
+        )
+    return current_user
+
+# Bearer token that lets a Prometheus server scrape /metrics without an admin account
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+async def get_metrics_reader(request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    """Allow METRICS_TOKEN as a bearer token, and otherwise require an admin."""
+    token = await oauth2_scheme(request)
+    if METRICS_TOKEN and secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return None
+    user = await resolve_user_async(token, db)
+    if user is None:
+        raise get_credentials_exception()
+    return await get_current_admin_user_async(user)
+
 def check_user_role(required_role: str):
     """Dependency function factory to check if user has a specific role."""
     async def check_role(current_user: models.User = Depends(get_current_user)):
@@ -161,4 +360,4 @@ def check_user_role(required_role: str):
         return current_user
     return check_role
 
-# Note: The async get_optional_current_user function defined above replaces this one
+# Note: The get_optional_current_user function defined above replaces this one
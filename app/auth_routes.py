@@ -2,39 +2,23 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from typing import Optional
 
-from . import database, models, schemas, auth, themes
+from . import database, models, schemas, auth, themes, counters, assets, instrumentation
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
-
-def get_current_theme(request: Request) -> tuple[themes.ThemeColors, str]:
-    """Get the current theme colors based on cookie or default"""
-    theme_name = request.cookies.get("theme", "gruvbox-dark")
-    theme = themes.get_theme(theme_name)
-    if not theme:
-        theme = themes.get_theme("gruvbox-dark")
-        theme_name = "gruvbox-dark"
-    return theme, theme_name
-
-def set_theme_cookie(response: HTMLResponse, theme_name: str) -> None:
-    """Set theme cookie with standard parameters"""
-    response.set_cookie(
-        key="theme",
-        value=theme_name,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False  # Allow non-HTTPS for local development
-    )
+instrumentation.instrument_templates(templates.env)
+templates.env.globals.update(themes.template_globals())
+templates.env.globals["static_url"] = assets.static_url
 
 @router.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
     """API endpoint for obtaining a token."""
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,12 +34,10 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 @router.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request):
     """Display registration page."""
-    theme, current_theme = get_current_theme(request)
     response = templates.TemplateResponse(
         "register.html",
-        {"request": request, "theme": theme, "current_theme": current_theme}
+        {"request": request}
     )
-    set_theme_cookie(response, current_theme)
     return response
 
 @router.post("/register", response_class=HTMLResponse)
@@ -64,42 +46,34 @@ async def register_user(
     email: str = Form(...),
     password: str = Form(...),
     confirm_password: str = Form(...),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Register a new user."""
-    theme, current_theme = get_current_theme(request)
-    
     # Validate inputs
     if password != confirm_password:
         response = templates.TemplateResponse(
             "register.html",
             {
                 "request": request,
-                "theme": theme,
-                "current_theme": current_theme,
                 "error": "Passwords do not match"
             }
         )
-        set_theme_cookie(response, current_theme)
         return response
     
     # Check if user already exists
-    existing_user = db.query(models.User).filter(models.User.email == email).first()
+    existing_user = await auth.get_user_by_email_async(db, email)
     if existing_user:
         response = templates.TemplateResponse(
             "register.html",
             {
                 "request": request,
-                "theme": theme,
-                "current_theme": current_theme,
                 "error": "Email already registered"
             }
         )
-        set_theme_cookie(response, current_theme)
         return response
     
     # Create new user
-    hashed_password = auth.get_password_hash(password)
+    hashed_password = await auth.get_password_hash_async(password)
     new_user = models.User(
         email=email,
         hashed_password=hashed_password,
@@ -107,24 +81,21 @@ async def register_user(
         is_active=True
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.run_sync(counters.record_user_added)
+    await db.commit()
     
     # Create success response with toast notification
     response = RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     response.headers["HX-Trigger"] = '{"showToast": {"message": "Registration successful! Please log in.", "type": "success"}}'
-    set_theme_cookie(response, current_theme)
     return response
 
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     """Display login page."""
-    theme, current_theme = get_current_theme(request)
     response = templates.TemplateResponse(
         "login.html",
-        {"request": request, "theme": theme, "current_theme": current_theme}
+        {"request": request}
     )
-    set_theme_cookie(response, current_theme)
     return response
 
 @router.post("/login", response_class=HTMLResponse)
@@ -132,24 +103,19 @@ async def login(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Log in a user."""
-    theme, current_theme = get_current_theme(request)
-    
     # Authenticate user
-    user = auth.authenticate_user(db, email, password)
+    user = await auth.authenticate_user_async(db, email, password)
     if not user:
         response = templates.TemplateResponse(
             "login.html",
             {
                 "request": request,
-                "theme": theme,
-                "current_theme": current_theme,
                 "error": "Invalid email or password"
             }
         )
-        set_theme_cookie(response, current_theme)
         return response
     
     # Create access token
@@ -169,42 +135,45 @@ async def login(
         secure=False  # Set to True in production with HTTPS
     )
     response.headers["HX-Trigger"] = '{"showToast": {"message": "Login successful!", "type": "success"}}'
-    set_theme_cookie(response, current_theme)
     return response
 
 @router.get("/logout", response_class=HTMLResponse)
 async def logout(request: Request):
     """Log out a user."""
+    token = await auth.get_token_from_cookie(request)
+    if token:
+        auth.identity_cache.discard(token)
     response = RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     response.delete_cookie(key="access_token")
     response.headers["HX-Trigger"] = '{"showToast": {"message": "Logged out successfully", "type": "success"}}'
     return response
 
-# Create a dependency that will check for authenticated user
-def user_dependency(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(database.get_db)):
-    return auth.get_current_user_sync(token, db)
-
 @router.get("/profile", response_class=HTMLResponse)
 async def profile(
     request: Request,
-    current_user: models.User = Depends(user_dependency),
-    db: Session = Depends(database.get_db)
+    current_user: models.User = Depends(auth.get_current_user_async),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     """Display user profile."""
-    theme, current_theme = get_current_theme(request)
-    
-    # Get user's books
-    books = db.query(models.Book).filter(models.Book.user_id == current_user.id).all()
+    # Get the user's reading summary and only the books the page shows
+    summary = await db.run_sync(counters.get_summary, current_user.id)
+    # Keep the summary if this first visit just built it
+    await db.commit()
+    result = await db.execute(
+        select(models.Book)
+        .filter(models.Book.user_id == current_user.id)
+        .order_by(models.Book.id.desc())
+        .limit(6)
+    )
+    recent_books = result.scalars().all()
     
     response = templates.TemplateResponse(
         "profile.html",
         {
             "request": request,
-            "theme": theme,
-            "current_theme": current_theme,
             "user": current_user,
-            "books": books
+            "summary": summary,
+            "recent_books": recent_books
         }
     )
-    set_theme_cookie(response, current_theme)
     return response
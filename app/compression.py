@@ -0,0 +1,190 @@
+"""Response compression: encoding negotiation, streaming encoders and precompressed static files.
+
+gzip and deflate come from zlib. zstd is used when the optional
+``zstandard`` package is installed.
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import zlib
+from typing import Dict, Iterable, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Encodings we can produce, most preferred first
+SUPPORTED_ENCODINGS = (["zstd"] if zstandard else []) + ["gzip", "deflate"]
+
+# Content types worth compressing; images, fonts and archives are compressed already
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "image/svg+xml",
+}
+
+# File extension of the precompressed sibling of a static file, per encoding
+PRECOMPRESSED_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+ZLIB_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Map each coding in an Accept-Encoding header to its q-value."""
+    qualities = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+
+def negotiate(header: Optional[str], available: Iterable[str] = SUPPORTED_ENCODINGS) -> Optional[str]:
+    """Pick the encoding to respond with, or None for an uncompressed response.
+
+    The client's q-values decide, and ties go to our order of preference.
+    """
+    if not header:
+        return None
+    qualities = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    return content_type.split(";", 1)[0].strip().lower() in COMPRESSIBLE_TYPES
+
+
+class Encoder:
+    """Incremental compressor for one response body."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            wbits = 31 if encoding == "gzip" else 15
+            self._compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, wbits)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it, so streamed responses are not held back."""
+        if self.encoding == "zstd":
+            return self._compressor.compress(data) + self._compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        """Compress the last chunk and end the stream."""
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress a whole body in one go."""
+    return Encoder(encoding).finish(data)
+
+
+def precompress_directory(directory: str, minimum_size: int = 512) -> int:
+    """Write .gz (and .zst) siblings next to compressible files that lack an up-to-date one.
+
+    Returns:
+        int: The number of compressed files written
+    """
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(tuple(PRECOMPRESSED_SUFFIXES.values())):
+                continue
+            if not is_compressible(mimetypes.guess_type(name)[0]):
+                continue
+            stat = os.stat(path)
+            if stat.st_size < minimum_size:
+                continue
+            data = None
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                if encoding not in SUPPORTED_ENCODINGS:
+                    continue
+                target = path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime >= stat.st_mtime:
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                if encoding == "gzip":
+                    # Fixed mtime so rebuilding an unchanged file gives identical bytes
+                    body = gzip.compress(data, compresslevel=9, mtime=0)
+                else:
+                    body = zstandard.ZstdCompressor(level=19).compress(data)
+                with open(target + ".tmp", "wb") as f:
+                    f.write(body)
+                os.replace(target + ".tmp", target)
+                written += 1
+    if written:
+        logger.info(f"Precompressed {written} static files in {directory}")
+    return written
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves a precompressed .zst or .gz sibling when the client accepts it."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+        if status_code == 200 and is_compressible(media_type) and "range" not in request_headers:
+            available = [
+                encoding
+                for encoding, suffix in PRECOMPRESSED_SUFFIXES.items()
+                if encoding in SUPPORTED_ENCODINGS and os.path.isfile(f"{full_path}{suffix}")
+            ]
+            encoding = negotiate(request_headers.get("accept-encoding"), available)
+            if encoding is not None:
+                compressed_path = f"{full_path}{PRECOMPRESSED_SUFFIXES[encoding]}"
+                compressed_stat = os.stat(compressed_path)
+                # A sibling older than its source is stale and ignored
+                if compressed_stat.st_mtime >= stat_result.st_mtime:
+                    response = FileResponse(
+                        compressed_path,
+                        stat_result=compressed_stat,
+                        media_type=media_type,
+                        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+                    )
+                    if self.is_not_modified(response.headers, request_headers):
+                        return NotModifiedResponse(response.headers)
+                    return response
+
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if is_compressible(media_type):
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
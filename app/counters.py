@@ -0,0 +1,350 @@
+"""Incrementally maintained counters for the admin dashboard and profile page.
+
+Global totals live in the ``counters`` table and per-user rollups in
+``reading_summaries``. Both are adjusted by the write paths in the same
+transaction as the change they describe. Reading them is then a
+primary-key lookup instead of a count over the books and users tables.
+"""
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Sequence
+
+from sqlalchemy import case, func, insert, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+BOOK_STATUSES = ["to_read", "reading", "completed", "on_hold", "dnf"]
+
+# Columns of ReadingSummary holding a count per status and per rating
+SUMMARY_COLUMNS = frozenset(BOOK_STATUSES + [f"rating_{rating}" for rating in range(4)])
+
+USERS = "users"
+
+# The fields of a book that the counters depend on, captured before a change
+BookState = namedtuple("BookState", ["id", "user_id", "status", "rating", "completion_date"])
+
+
+def book_counter(status: str) -> str:
+    """Name of the counter tracking books with the given status."""
+    return f"books:{status}"
+
+
+def library_counter(user_id: Optional[int]) -> str:
+    """Name of the counter bumped on every change to a user's books, or the anonymous board's."""
+    return f"library:{user_id if user_id is not None else 'anonymous'}"
+
+
+def snapshot(book: models.Book) -> BookState:
+    """Capture the counted fields of a book before it is modified."""
+    return BookState(book.id, book.user_id, book.status, book.rating, book.completion_date)
+
+
+def adjust(db: Session, name: str, delta: int) -> None:
+    """Add delta to a counter without committing."""
+    if not delta:
+        return
+    # Increment in SQL so concurrent writers cannot lose updates
+    updated = (
+        db.query(models.Counter)
+        .filter(models.Counter.name == name)
+        .update({models.Counter.value: models.Counter.value + delta})
+    )
+    if not updated:
+        db.add(models.Counter(name=name, value=delta))
+        db.flush()
+
+
+def _summary_deltas(state: Optional[BookState], user_id: int, sign: int) -> Dict[str, int]:
+    """Summary columns a book contributes to, scaled by sign."""
+    if state is None or state.user_id != user_id:
+        return {}
+    deltas = {state.status: sign}
+    if state.rating is not None:
+        deltas[f"rating_{state.rating}"] = sign
+    # A status or rating the summary has no column for is not counted
+    return {column: delta for column, delta in deltas.items() if column in SUMMARY_COLUMNS}
+
+
+def _is_latest_candidate(state: Optional[BookState], user_id: int) -> bool:
+    """Whether a book can provide the user's last completion date."""
+    return (
+        state is not None
+        and state.user_id == user_id
+        and state.status == "completed"
+        and state.completion_date is not None
+    )
+
+
+def _increments(deltas: Dict[str, int]) -> dict:
+    """SQL increments of summary columns for an update() call."""
+    Summary = models.ReadingSummary
+    return {
+        getattr(Summary, column): getattr(Summary, column) + delta
+        for column, delta in deltas.items()
+        if delta
+    }
+
+
+def _keep_latest(completed_at: datetime):
+    """SQL expression moving last_completed_at forward to completed_at if it is later."""
+    Summary = models.ReadingSummary
+    return case(
+        (
+            or_(Summary.last_completed_at.is_(None), Summary.last_completed_at < completed_at),
+            completed_at,
+        ),
+        else_=Summary.last_completed_at,
+    )
+
+
+def _write_summary(db: Session, user_id: int, values: dict) -> None:
+    """Apply column updates to a user's summary, building it if it does not exist."""
+    Summary = models.ReadingSummary
+    if not values:
+        return
+    updated = (
+        db.query(Summary)
+        .filter(Summary.user_id == user_id)
+        .update(values, synchronize_session=False)
+    )
+    if not updated:
+        # First change for this user since summaries existed: write the change
+        # out and build the summary from what is now in the table
+        db.flush()
+        if not _insert_summary(db, build_summary(db, user_id)):
+            # Built meanwhile by another transaction, which did not see this change
+            db.query(Summary).filter(Summary.user_id == user_id).update(
+                values, synchronize_session=False
+            )
+
+
+def _insert_summary(db: Session, summary: models.ReadingSummary) -> bool:
+    """Insert a built summary unless the user already has one.
+
+    Returns:
+        bool: Whether it was inserted, rather than lost to a concurrent insert
+    """
+    Summary = models.ReadingSummary
+    values = {column.name: getattr(summary, column.key) for column in Summary.__table__.columns}
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite_insert(Summary).values(values).on_conflict_do_nothing(index_elements=[Summary.user_id])
+    elif dialect == "postgresql":
+        statement = postgresql_insert(Summary).values(values).on_conflict_do_nothing(index_elements=[Summary.user_id])
+    else:
+        statement = insert(Summary).values(values)
+    return db.execute(statement).rowcount == 1
+
+
+def _update_summary(
+    db: Session, user_id: int, before: Optional[BookState], after: Optional[BookState]
+) -> None:
+    """Apply the difference between two states of a book to a user's summary."""
+    Summary = models.ReadingSummary
+    deltas = _summary_deltas(after, user_id, 1)
+    for column, delta in _summary_deltas(before, user_id, -1).items():
+        deltas[column] = deltas.get(column, 0) + delta
+
+    values = _increments(deltas)
+
+    completed_at = after.completion_date if _is_latest_candidate(after, user_id) else None
+    if _is_latest_candidate(before, user_id) and (
+        completed_at is None or completed_at < before.completion_date
+    ):
+        # The book may have been the latest completion, so look at the others
+        latest = (
+            db.query(func.max(models.Book.completion_date))
+            .filter(
+                models.Book.user_id == user_id,
+                models.Book.status == "completed",
+                models.Book.id != before.id,
+            )
+            .scalar()
+        )
+        if completed_at is not None and (latest is None or completed_at > latest):
+            latest = completed_at
+        values[Summary.last_completed_at] = latest
+    elif completed_at is not None:
+        values[Summary.last_completed_at] = _keep_latest(completed_at)
+
+    _write_summary(db, user_id, values)
+
+
+def record_book_changed(
+    db: Session, before: Optional[BookState], book: Optional[models.Book]
+) -> None:
+    """Update counters and summaries for a book going from before to its current state.
+
+    Pass before=None for a new book and call it after db.delete() with
+    book=None for a deleted one. Nothing is committed.
+    """
+    after = snapshot(book) if book is not None else None
+
+    old_status = before.status if before else None
+    new_status = after.status if after else None
+    if old_status != new_status:
+        if old_status is not None:
+            adjust(db, book_counter(old_status), -1)
+        if new_status is not None:
+            adjust(db, book_counter(new_status), 1)
+
+    boards = {state.user_id for state in (before, after) if state}
+    for user_id in boards:
+        adjust(db, library_counter(user_id), 1)
+        if user_id is not None:
+            _update_summary(db, user_id, before, after)
+
+
+def record_book_added(db: Session, book: models.Book) -> None:
+    """Count a newly created book."""
+    record_book_changed(db, None, book)
+
+
+def record_books_added(db: Session, books: Sequence[models.Book]) -> None:
+    """Count a batch of new books with one update per counter and per user summary."""
+    status_counts: Dict[str, int] = {}
+    user_deltas: Dict[int, Dict[str, int]] = {}
+    user_latest: Dict[int, datetime] = {}
+    for book in books:
+        state = snapshot(book)
+        status_counts[state.status] = status_counts.get(state.status, 0) + 1
+        if state.user_id is None:
+            continue
+        deltas = user_deltas.setdefault(state.user_id, {})
+        for column, delta in _summary_deltas(state, state.user_id, 1).items():
+            deltas[column] = deltas.get(column, 0) + delta
+        if _is_latest_candidate(state, state.user_id):
+            latest = user_latest.get(state.user_id)
+            if latest is None or state.completion_date > latest:
+                user_latest[state.user_id] = state.completion_date
+
+    for status, count in status_counts.items():
+        adjust(db, book_counter(status), count)
+    record_libraries_changed(db, {book.user_id for book in books})
+    for user_id, deltas in user_deltas.items():
+        values = _increments(deltas)
+        if user_id in user_latest:
+            values[models.ReadingSummary.last_completed_at] = _keep_latest(user_latest[user_id])
+        _write_summary(db, user_id, values)
+
+
+def record_libraries_changed(db: Session, user_ids: Iterable[Optional[int]]) -> None:
+    """Bump the library versions of users whose books were written outside the usual paths."""
+    for user_id in user_ids:
+        adjust(db, library_counter(user_id), 1)
+
+
+def record_book_removed(db: Session, book: models.Book) -> None:
+    """Uncount a deleted book."""
+    record_book_changed(db, snapshot(book), None)
+
+
+def record_user_added(db: Session) -> None:
+    """Count a newly registered user."""
+    adjust(db, USERS, 1)
+
+
+def get_counts(db: Session) -> Dict[str, int]:
+    """Return the global totals by name, with missing counters reported as zero.
+
+    Only the users and per-status book counters are read, by primary key;
+    the per-user library versions in the same table are left out.
+    """
+    names = [book_counter(status) for status in BOOK_STATUSES] + [USERS]
+    counts = dict.fromkeys(names, 0)
+    for counter in db.query(models.Counter).filter(models.Counter.name.in_(names)):
+        counts[counter.name] = counter.value
+    return counts
+
+
+def get_library_version(db: Session, user_id: Optional[int]) -> int:
+    """Return how many times a user's books, or the anonymous board, have changed."""
+    counter = db.get(models.Counter, library_counter(user_id))
+    return counter.value if counter is not None else 0
+
+
+def build_summary(db: Session, user_id: int) -> models.ReadingSummary:
+    """Build a user's reading summary from a full recount of their books."""
+    summary = models.ReadingSummary(user_id=user_id)
+    for column in BOOK_STATUSES + [f"rating_{rating}" for rating in range(4)]:
+        setattr(summary, column, 0)
+
+    user_books = db.query(models.Book).filter(models.Book.user_id == user_id)
+    for status, count in (
+        user_books.with_entities(models.Book.status, func.count(models.Book.id))
+        .group_by(models.Book.status)
+        .all()
+    ):
+        if status in SUMMARY_COLUMNS:
+            setattr(summary, status, count)
+    for rating, count in (
+        user_books.filter(models.Book.rating != None)  # noqa: E711
+        .with_entities(models.Book.rating, func.count(models.Book.id))
+        .group_by(models.Book.rating)
+        .all()
+    ):
+        if f"rating_{rating}" in SUMMARY_COLUMNS:
+            setattr(summary, f"rating_{rating}", count)
+    summary.last_completed_at = (
+        user_books.filter(models.Book.status == "completed")
+        .with_entities(func.max(models.Book.completion_date))
+        .scalar()
+    )
+    return summary
+
+
+def get_summary(db: Session, user_id: int) -> models.ReadingSummary:
+    """Return a user's reading summary, building it on first use.
+
+    A built summary is inserted but not committed; the caller's commit, or
+    the session closing, decides whether it is kept. Two first reads at once
+    both build it and one insert is skipped.
+    """
+    summary = db.get(models.ReadingSummary, user_id)
+    if summary is None:
+        _insert_summary(db, build_summary(db, user_id))
+        summary = db.get(models.ReadingSummary, user_id)
+    return summary
+
+
+def reconcile(db: Session) -> Dict[str, int]:
+    """Recount users and books from scratch and overwrite the stored counters.
+
+    Per-user summaries are dropped and rebuilt lazily on their next use.
+    Library versions are kept, since clients hold ETags derived from them.
+
+    Returns:
+        dict: The counters that were wrong, mapped to how far off they were
+    """
+    actual = {book_counter(status): 0 for status in BOOK_STATUSES}
+    for status, count in (
+        db.query(models.Book.status, func.count(models.Book.id))
+        .group_by(models.Book.status)
+        .all()
+    ):
+        actual[book_counter(status)] = count
+    actual[USERS] = db.query(func.count(models.User.id)).scalar()
+
+    stored = get_counts(db)
+    drift = {
+        name: stored.get(name, 0) - value
+        for name, value in actual.items()
+        if stored.get(name, 0) != value
+    }
+
+    db.query(models.Counter).filter(~models.Counter.name.like("library:%")).delete(
+        synchronize_session=False
+    )
+    db.query(models.ReadingSummary).delete()
+    db.add_all(models.Counter(name=name, value=value) for name, value in actual.items())
+    db.commit()
+    return drift
+
+
+def ensure_initialized(db: Session) -> None:
+    """Build the counters from a full recount if they have never been built."""
+    if db.query(models.Counter).first() is None:
+        reconcile(db)
@@ -1,16 +1,20 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
 from dotenv import load_dotenv
 import logging
 
+# Loaded before the modules below read their settings from the environment
+load_dotenv()
+
+from . import instrumentation, logs  # noqa: E402
+
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+logs.configure_logging()
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 # Create data directory if it doesn't exist
 data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 os.makedirs(data_dir, exist_ok=True)
@@ -26,9 +30,80 @@ logger.info(f"Database URL: {SQLALCHEMY_DATABASE_URL}")
 # Ensure SQLite connection works with check_same_thread=False
 connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args=connect_args,
+    poolclass=instrumentation.timed_pool_class(SQLALCHEMY_DATABASE_URL, "sync"),
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Pragmas applied to every new SQLite connection. WAL lets readers run
+# alongside a writer, and busy_timeout makes writers wait for the lock
+# instead of failing straight away with "database is locked".
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT", "5000"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-64000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "foreign_keys": os.getenv("SQLITE_FOREIGN_KEYS", "ON"),
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Apply SQLITE_PRAGMAS to a new DBAPI connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            if value != "":
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def sqlite_settings(bind) -> dict:
+    """Read back the pragma values a connection of this engine actually runs with."""
+    with bind.connect() as connection:
+        return {
+            name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in SQLITE_PRAGMAS
+        }
+
+instrumentation.instrument_engine(engine, "sync")
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+
+# asyncio drivers to use in place of the default driver of each backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def to_async_url(url: str) -> str:
+    """Swap the driver in a database URL for its asyncio counterpart."""
+    scheme, separator, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect not in ASYNC_DRIVERS:
+        return url
+    return f"{ASYNC_DRIVERS[dialect]}{separator}{rest}"
+
+# Async engine for request handlers, sharing the database with the sync engine
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    to_async_url(SQLALCHEMY_DATABASE_URL)
+)
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=instrumentation.timed_pool_class(ASYNC_SQLALCHEMY_DATABASE_URL, "async"),
+)
+instrumentation.instrument_engine(async_engine.sync_engine, "async")
+if async_engine.dialect.name == "sqlite":
+    # Connection events are only emitted by the sync engine behind the async one
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+# Objects are not expired on commit, since lazy reloads cannot run under asyncio
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -37,3 +112,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
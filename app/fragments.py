@@ -0,0 +1,111 @@
+"""Per-process cache of rendered HTML fragments.
+
+Fragments are keyed by everything their output depends on, such as a
+book's id and row version, so an update needs no invalidation: it
+produces a new key and the old entry ages out of the LRU order once the
+memory budget is reached. A deleted book's entry is evicted, and since
+book ids are never reused, a new book can't pick up another worker's
+stale card either.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+from markupsafe import Markup
+
+from . import metrics
+
+# Memory budget for cached fragments, in bytes
+FRAGMENT_CACHE_BYTES = int(os.getenv("FRAGMENT_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+fragment_cache_hits = metrics.REGISTRY.counter(
+    "fragment_cache_hits_total", "Fragments served from the fragment cache", ["fragment"]
+)
+fragment_cache_misses = metrics.REGISTRY.counter(
+    "fragment_cache_misses_total", "Fragments that had to be rendered", ["fragment"]
+)
+fragment_cache_evictions = metrics.REGISTRY.counter(
+    "fragment_cache_evictions_total", "Fragments dropped to stay within the memory budget"
+)
+fragment_cache_bytes = metrics.REGISTRY.gauge(
+    "fragment_cache_bytes", "Memory held by cached fragments"
+)
+
+
+class FragmentCache:
+    """LRU cache of rendered fragments bounded by the memory they take up."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Markup]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, fragment: str, key: Hashable, render: Callable[[], str]) -> Markup:
+        """Return the cached fragment for key, rendering and caching it on a miss."""
+        key = (fragment, key)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+        if html is not None:
+            self.hits += 1
+            fragment_cache_hits.inc(fragment=fragment)
+            return html
+
+        self.misses += 1
+        fragment_cache_misses.inc(fragment=fragment)
+        html = Markup(render())
+        self._store(key, html)
+        return html
+
+    def _store(self, key: Hashable, html: Markup) -> None:
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= sys.getsizeof(previous)
+            self._entries[key] = html
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+                self.evictions += 1
+                fragment_cache_evictions.inc()
+            fragment_cache_bytes.set(self.size)
+
+    def evict(self, fragment: str, match: Callable[[Hashable], bool]) -> None:
+        """Drop the cached fragments whose key matches, such as every version of a deleted book."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == fragment and match(key[1])]:
+                self.size -= sys.getsizeof(self._entries.pop(key))
+            fragment_cache_bytes.set(self.size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            fragment_cache_bytes.set(0)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss counts and memory use, for the admin pages."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_BYTES)
@@ -0,0 +1,209 @@
+"""Import Goodreads and StoryGraph library exports.
+
+Both sites export a CSV file with one row per book. The file is read one
+row at a time and books are inserted in batches, each committed on its own,
+so memory use does not grow with the size of the library.
+"""
+import csv
+import io
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from . import counters, models
+
+# Goodreads "Exclusive Shelf" and StoryGraph "Read Status" values
+SHELF_STATUSES = {
+    "read": "completed",
+    "currently-reading": "reading",
+    "to-read": "to_read",
+    "paused": "on_hold",
+    "on-hold": "on_hold",
+    "did-not-finish": "dnf",
+    "dnf": "dnf",
+}
+
+# Columns each export uses for the fields we import
+FORMATS = {
+    "goodreads": {
+        "title": "Title",
+        "author": "Author",
+        "shelf": "Exclusive Shelf",
+        "rating": "My Rating",
+        "completed": "Date Read",
+        "notes": ["My Review", "Private Notes"],
+    },
+    "storygraph": {
+        "title": "Title",
+        "author": "Authors",
+        "shelf": "Read Status",
+        "rating": "Star Rating",
+        "completed": "Last Date Read",
+        "started": "Dates Read",
+        "notes": ["Review"],
+    },
+}
+
+DATE_FORMATS = ("%Y/%m/%d", "%Y-%m-%d")
+
+MAX_ERRORS_REPORTED = 1000
+
+
+class Export(NamedTuple):
+    """An opened export: its detected format and a reader positioned after the header."""
+    format: str
+    header: List[str]
+    reader: Iterator[List[str]]
+
+
+def open_export(file: BinaryIO) -> Export:
+    """Read the header of an uploaded CSV export and detect which site it came from.
+
+    Raises:
+        ValueError: If the file is not a CSV export we recognise
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace", newline="")
+    reader = csv.reader(text)
+    try:
+        header = [column.strip() for column in next(reader)]
+    except (StopIteration, csv.Error):
+        raise ValueError("The file is empty or not a CSV file")
+
+    for name, columns in FORMATS.items():
+        if columns["title"] in header and columns["shelf"] in header:
+            return Export(name, header, reader)
+    raise ValueError("Unrecognised CSV export: expected a Goodreads or StoryGraph library export")
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """Parse a date as written by either export, or None if it is blank."""
+    value = value.strip()
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised date '{value}'")
+
+
+def parse_rating(value: str) -> Optional[int]:
+    """Map a 0-5 star rating onto the app's 0-3 scale; 0 or blank stars means unrated."""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        stars = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid rating '{value}'")
+    if not 0 <= stars <= 5:
+        raise ValueError(f"Rating '{value}' is outside 0-5 stars")
+    if stars == 0:
+        return None
+    if stars >= 4:
+        return 3
+    if stars >= 3:
+        return 2
+    return 1
+
+
+def parse_row(export_format: str, row: Dict[str, str]) -> Dict:
+    """Turn one CSV row into the columns of a Book.
+
+    Raises:
+        ValueError: If the row cannot be imported
+    """
+    columns = FORMATS[export_format]
+
+    title = row.get(columns["title"], "").strip()
+    if not title:
+        raise ValueError("Missing title")
+
+    shelf = row.get(columns["shelf"], "").strip().lower()
+    status = SHELF_STATUSES.get(shelf)
+    if status is None:
+        raise ValueError(f"Unknown shelf '{shelf}'")
+
+    rating = parse_rating(row.get(columns["rating"], ""))
+    if rating is None and status == "dnf":
+        rating = 0
+
+    start_date = None
+    if "started" in columns:
+        # StoryGraph writes read-throughs as "2023/01/05-2023/02/10, ..."
+        first_read = row.get(columns["started"], "").split(",")[0]
+        start_date = parse_date(first_read.split("-")[0]) if first_read.strip() else None
+
+    notes = "\n\n".join(
+        row[column].strip() for column in columns["notes"] if row.get(column, "").strip()
+    )
+
+    return {
+        "title": title[:255],
+        "author": row.get(columns["author"], "").strip()[:255] or None,
+        "status": status,
+        "rating": rating,
+        "start_date": start_date,
+        "completion_date": parse_date(row.get(columns["completed"], "")),
+        "notes": notes or None,
+    }
+
+
+def import_books(db: Session, export: Export, user_id: int, batch_size: int) -> Iterator[Dict]:
+    """Insert the books of an export for a user and yield progress events as it goes.
+
+    Events are dicts with an "event" key: "error" for each row that was
+    skipped, "progress" after each committed batch and "done" at the end.
+    """
+    rows = imported = errors = 0
+    batch: List[models.Book] = []
+
+    def commit_batch():
+        db.add_all(batch)
+        counters.record_books_added(db, batch)
+        db.commit()
+        # Drop the committed books so the session does not grow with the import
+        db.expunge_all()
+        batch.clear()
+
+    while True:
+        try:
+            values = next(export.reader)
+        except StopIteration:
+            break
+        except csv.Error as e:
+            rows += 1
+            errors += 1
+            if errors <= MAX_ERRORS_REPORTED:
+                yield {"event": "error", "line": export.reader.line_num, "error": str(e)}
+            continue
+        if not any(value.strip() for value in values):
+            continue
+
+        rows += 1
+        try:
+            data = parse_row(export.format, dict(zip(export.header, values)))
+        except ValueError as e:
+            errors += 1
+            if errors <= MAX_ERRORS_REPORTED:
+                yield {"event": "error", "line": export.reader.line_num, "error": str(e)}
+            continue
+
+        batch.append(models.Book(user_id=user_id, **data))
+        if len(batch) >= batch_size:
+            imported += len(batch)
+            commit_batch()
+            yield {"event": "progress", "rows": rows, "imported": imported, "errors": errors}
+
+    if batch:
+        imported += len(batch)
+        commit_batch()
+    yield {
+        "event": "done",
+        "format": export.format,
+        "rows": rows,
+        "imported": imported,
+        "errors": errors,
+    }
@@ -0,0 +1,171 @@
+"""Metrics collected from SQLAlchemy and Jinja2.
+
+SQL statements are timed through engine events, connection pool checkouts
+through a subclass of the engine's pool class, and template renders
+through a Template subclass. Request metrics are collected by
+middleware.MetricsMiddleware.
+
+The same engine events count the queries of the current request, when
+middleware.QueryCountMiddleware has started a QueryStats for it, and flag
+a statement that runs over and over within one request, the usual sign of
+a lazy relationship loaded in a loop.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional, Type
+
+from jinja2 import Environment, Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import Pool
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Add X-DB-Query-Count and X-DB-Time headers to every response
+DEV_MODE = os.getenv("DEV_MODE", "").lower() in ("1", "true", "yes")
+# Runs of one statement in a request beyond which it is reported
+REPEATED_QUERY_THRESHOLD = int(os.getenv("REPEATED_QUERY_THRESHOLD", "10"))
+# Raise RepeatedQueryError instead of logging a warning, so tests fail on N+1 queries
+RAISE_ON_REPEATED_QUERIES = os.getenv("RAISE_ON_REPEATED_QUERIES", "").lower() in ("1", "true", "yes")
+
+db_query_seconds = metrics.REGISTRY.histogram(
+    "db_query_seconds", "Time spent executing SQL statements", ["engine", "operation"]
+)
+db_pool_checkout_seconds = metrics.REGISTRY.histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a pooled connection, including opening new ones",
+    ["engine"],
+)
+db_pool_checked_out = metrics.REGISTRY.gauge(
+    "db_pool_connections_in_use", "Connections checked out of the pool", ["engine"]
+)
+template_render_seconds = metrics.REGISTRY.histogram(
+    "template_render_seconds", "Time spent rendering templates", ["template"]
+)
+
+# Statement types reported separately; anything else is counted as "other"
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+class RepeatedQueryError(RuntimeError):
+    """A request ran the same statement more than REPEATED_QUERY_THRESHOLD times."""
+
+
+class QueryStats:
+    """Queries run while handling one request."""
+
+    def __init__(self, request: str):
+        self.request = request
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def record_start(self, statement: str) -> None:
+        self.count += 1
+        self.statements[statement] += 1
+        runs = self.statements[statement]
+        # Reported once per statement, when it crosses the threshold
+        if runs != REPEATED_QUERY_THRESHOLD + 1:
+            return
+        message = (
+            f"{self.request} ran the same query more than {REPEATED_QUERY_THRESHOLD} times, "
+            f"likely an N+1 pattern: {' '.join(statement.split())}"
+        )
+        if RAISE_ON_REPEATED_QUERIES:
+            raise RepeatedQueryError(message)
+        logger.warning(message)
+
+
+# Stats of the request being handled; copied into the threads and greenlets that run its queries
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+def sql_operation(statement: str) -> str:
+    """The statement type of a SQL string, such as SELECT, for use as a label."""
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return keyword if keyword in SQL_OPERATIONS else "other"
+
+
+def timed_pool_class(url: str, name: str) -> Type[Pool]:
+    """The pool class the dialect of this URL would use, timing its checkouts.
+
+    Pass it as the poolclass of the engine. The pool has no event for the
+    start of a checkout, so connect() itself is timed; dispose() and
+    recreate() build the new pool from the same class, so the timing
+    carries over to it.
+    """
+    url = make_url(url)
+    base = url.get_dialect().get_pool_class(url)
+
+    class TimedPool(base):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                db_pool_checkout_seconds.observe(time.perf_counter() - started, engine=name)
+
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Time the statements and count the checked out connections of a sync engine.
+
+    For an AsyncEngine, pass its sync_engine: the async engine emits its
+    events through it.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Pushed first, so that handle_error has an entry to pop if record_start raises
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.record_start(statement)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_seconds.observe(elapsed, engine=name, operation=sql_operation(statement))
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        # after_cursor_execute does not run for a failed statement
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_checked_out.inc(engine=name)
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        db_pool_checked_out.dec(engine=name)
+
+
+class TimedTemplate(Template):
+    """Template that records how long each top-level render takes."""
+
+    def render(self, *args, **kwargs) -> str:
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            template_render_seconds.observe(
+                time.perf_counter() - started, template=self.name or "<string>"
+            )
+
+
+def instrument_templates(env: Environment) -> None:
+    """Time renders of the templates loaded from env from now on."""
+    env.template_class = TimedTemplate
@@ -0,0 +1,162 @@
+"""Structured logging through a background thread.
+
+Every record goes to a QueueHandler on the root logger and is written out
+by a QueueListener thread, so request handlers never wait on stderr. The
+handler stamps each record with the id of the request it was logged in,
+set by middleware.RequestContextMiddleware, and formats its message while
+the arguments are still current.
+
+High-frequency events are logged with extra={"sampled": True}. Below
+WARNING, those are only kept for the share of requests set for their
+route in LOG_SAMPLE_RATES, decided once per request so that a kept
+request keeps all of its events.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for plain lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """Parse "route=rate,..." as in LOG_SAMPLE_RATES; "*" sets the rate of other routes."""
+    rates = {}
+    for item in value.split(","):
+        route, _, rate = item.strip().rpartition("=")
+        if route:
+            rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+# Share of requests per route template whose sampled events are logged
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+# Attributes every LogRecord has; anything else was passed in extra and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "request_id",
+    "sampled",
+    "taskName",
+    "color_message",  # uvicorn's copy of the message with terminal colors
+}
+
+
+@dataclass
+class RequestContext:
+    request_id: str
+    route: str
+    keep_sampled: bool
+
+
+current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+def sample_rate(route: str) -> float:
+    return LOG_SAMPLE_RATES.get(route, LOG_SAMPLE_RATES.get("*", 1.0))
+
+
+def start_request(request_id: str, route: str) -> RequestContext:
+    """The logging context of a new request, deciding whether its sampled events are kept."""
+    rate = sample_rate(route)
+    return RequestContext(request_id, route, rate >= 1.0 or random.random() < rate)
+
+
+class RequestQueueHandler(QueueHandler):
+    """QueueHandler that drops unsampled events and stamps records with the request id."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = current_request.get()
+        if (
+            getattr(record, "sampled", False)
+            and record.levelno < logging.WARNING
+            and context is not None
+            and not context.keep_sampled
+        ):
+            return False
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare, keep the fields apart for the formatter
+        context = current_request.get()
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = context.request_id if context else None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed in extra at the top level."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.message if hasattr(record, "message") else record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", None) or "-"
+        return super().format(record)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging() -> None:
+    """Send all logging through the queue to a JSON (or text) writer on stderr.
+
+    Safe to call more than once. uvicorn's loggers are routed through the
+    same queue, so access logs come out in the same format.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(RequestQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
@@ -1,18 +1,53 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Form, Cookie
+from fastapi import FastAPI, Depends, HTTPException, Request, Form, Cookie, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import UploadFile
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from pydantic import BaseModel, field_validator
+from contextlib import asynccontextmanager
 from datetime import datetime
-
-from . import models, database, themes, auth, auth_routes, admin_routes
+import base64
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+
+from . import models, database, schemas, themes, auth, auth_routes, admin_routes, counters, importers, search, fragments, assets, instrumentation, metrics, startup
 from .auth import get_optional_current_user
+from .assets import FingerprintedStaticFiles
+from .middleware import (
+    CompressionMiddleware,
+    CookieToAuthorizationMiddleware,
+    MetricsMiddleware,
+    ProfilingMiddleware,
+    QueryCountMiddleware,
+    RequestContextMiddleware,
+)
+
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI(title="Book Tracker")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema, migrations, admin user, counters, search index and asset manifest,
+    # then the warm-up in the background; see app/startup.py and GET /ready
+    warm_up = await startup.run_startup([templates.env, auth_routes.templates.env, admin_routes.templates.env])
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    await database.async_engine.dispose()
+
+
+app = FastAPI(title="Book Tracker", lifespan=lifespan)
 templates = Jinja2Templates(directory="app/templates")
+instrumentation.instrument_templates(templates.env)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,34 +59,24 @@ app.add_middleware(
 )
 
 
-# Add middleware to extract token from cookies
-@app.middleware("http")
-async def cookie_to_authorization(request: Request, call_next):
-    # Extract token from cookie
-    token = request.cookies.get("access_token")
+# Replace the response of admin requests made with ?__profile=1 by a profile report
+app.add_middleware(ProfilingMiddleware, render=admin_routes.render_profile)
 
-    # Check if we have a token and no authorization header already exists
-    has_auth_header = False
-    for k, v in request.scope.get("headers", []):
-        if k.decode().lower() == "authorization":
-            has_auth_header = True
-            break
+# Count the queries of each request, warning about N+1 patterns, and report them in DEV_MODE
+app.add_middleware(QueryCountMiddleware, headers=instrumentation.DEV_MODE)
 
-    # Create a modified scope with the authorization header if token exists and no auth header
-    if token and not has_auth_header:
-        # Get the original headers as a list of tuples
-        headers = list(request.scope.get("headers", []))
+# Copy the token cookie into the Authorization header for the OAuth2 dependencies
+app.add_middleware(CookieToAuthorizationMiddleware)
 
-        # Add the authorization header
-        auth_value = f"Bearer {token}"
-        headers.append((b"authorization", auth_value.encode()))
+# Compress pages and API responses; smaller bodies are not worth the CPU
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
 
-        # Update the scope headers
-        request.scope["headers"] = headers
+# Request latency includes the compression and the other middleware
+app.add_middleware(MetricsMiddleware)
 
-    # Process the request and get the response
-    response = await call_next(request)
-    return response
+# Outermost, so everything logged for a request carries its id
+app.add_middleware(RequestContextMiddleware)
 
 
 # Include auth routes
@@ -60,20 +85,40 @@ app.include_router(auth_routes.router)
 # Include admin routes
 app.include_router(admin_routes.router)
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# Mount static files, serving the .zst/.gz siblings written on startup when clients accept them
+# and fingerprinted names (see assets.static_url) with immutable caching
+app.mount(
+    "/static",
+    FingerprintedStaticFiles(directory="app/static", manifest=assets.static_assets),
+    name="static",
+)
+
+
+def render_book_card(book: models.Book):
+    """Render a book card, reusing the cached HTML for the same row version"""
+    return fragments.fragment_cache.get_or_render(
+        "book_card",
+        (book.id, book.version),
+        lambda: templates.get_template("partials/book_card.html").render(book=book),
+    )
+
+
+def evict_book_card(book_id: int):
+    fragments.fragment_cache.evict("book_card", lambda key: key[0] == book_id)
 
-# Default theme
-DEFAULT_THEME = "gruvbox-dark"
+
+templates.env.globals["render_book_card"] = render_book_card
+templates.env.globals.update(themes.template_globals())
+templates.env.globals["static_url"] = assets.static_url
 
 
 def get_current_theme(request: Request) -> tuple[themes.ThemeColors, str]:
     """Get the current theme colors based on cookie or default"""
-    theme_name = request.cookies.get("theme", DEFAULT_THEME)
+    theme_name = request.cookies.get("theme", themes.DEFAULT_THEME)
     theme = themes.get_theme(theme_name)
     if not theme:
-        theme = themes.get_theme(DEFAULT_THEME)
-        theme_name = DEFAULT_THEME
+        theme = themes.get_theme(themes.DEFAULT_THEME)
+        theme_name = themes.DEFAULT_THEME
     return theme, theme_name
 
 
@@ -125,34 +170,104 @@ class Book(BookCreate):
         from_attributes = True
 
 
-# Create tables if they don't exist
-from sqlalchemy import inspect
+class BookPage(BaseModel):
+    items: List[Book]
+    next_cursor: Optional[str] = None
+
+
+class SearchResult(BaseModel):
+    book: Book
+    title_html: str
+    author_html: Optional[str] = None
+    snippet_html: Optional[str] = None
+
+
+def fingerprint_templates(directory: str) -> str:
+    """Hash the templates, so a deploy that changes them also changes every ETag"""
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()[:16]
+
+
+TEMPLATE_FINGERPRINT = fingerprint_templates("app/templates")
+
+# Sent with every ETagged response so browsers revalidate instead of reusing it blindly
+CONDITIONAL_HEADERS = {"Cache-Control": "private, no-cache", "Vary": "Cookie, Authorization"}
+
+
+def library_etag(
+    request: Request, db: Session, current_user: Optional[models.User], *parts
+) -> str:
+    """Strong ETag for a view of a board, from its library version and the viewer's settings"""
+    user_id = current_user.id if current_user else None
+    version = counters.get_library_version(db, user_id)
+    key = "|".join(
+        str(part)
+        for part in (
+            TEMPLATE_FINGERPRINT,
+            assets.static_assets.fingerprint,
+            themes.THEMES_FINGERPRINT,
+            user_id,
+            current_user.role if current_user else "",
+            version,
+            *parts,
+        )
+    )
+    return f'"{version}-{hashlib.sha256(key.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the client already holds the representation with this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, **CONDITIONAL_HEADERS})
 
-# Check if tables exist before creating them
-inspector = inspect(database.engine)
-existing_tables = inspector.get_table_names()
 
-# Only create tables that don't exist yet
-for table in models.Base.metadata.tables.values():
-    if table.name not in existing_tables:
-        table.create(database.engine)
+def encode_cursor(book_id: int) -> str:
+    """Encode the last seen book id as an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(str(book_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Decode a pagination cursor back into the last seen book id"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @app.get("/")
-def home(request: Request, db: Session = Depends(database.get_db)):
-    # Get current user from token cookie if available
-    access_token = request.cookies.get("access_token")
-    current_user = None
+def home(
+    request: Request,
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_current_user),
+):
+    # Answer revalidations from the library version before loading any books
+    etag = library_etag(request, db, current_user)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # Anonymous users and invalid tokens get the anonymous board
+    response = render_board(request, db, current_user)
+    response.headers.update({"ETag": etag, **CONDITIONAL_HEADERS})
+    return response
 
-    if access_token:
-        # Token is stored without Bearer prefix
-        try:
-            current_user = auth.get_optional_current_user_sync(access_token, db)
-        except Exception as e:
-            # Invalid token, ignore and proceed as anonymous user
-            print(f"Authentication error: {e}")
-            pass
 
+def render_board(
+    request: Request, db: Session, current_user: Optional[models.User]
+) -> HTMLResponse:
+    """Render the full board page for the current user"""
     # Get books (filter by user if logged in)
     if current_user:
         books = (
@@ -160,49 +275,88 @@ def home(request: Request, db: Session = Depends(database.get_db)):
         )
     else:
         # For anonymous users, show books without user_id (legacy data) or make them log in
-        books = db.query(models.Book).filter(models.Book.user_id is None).all()
+        books = db.query(models.Book).filter(models.Book.user_id.is_(None)).all()
 
-    theme, current_theme = get_current_theme(request)
-    response = templates.TemplateResponse(
+    return templates.TemplateResponse(
         "index.html",
         {
             "request": request,
             "books": books,
-            "theme": theme,
-            "current_theme": current_theme,
             "user": current_user,
         },
     )
-    response.set_cookie(
-        key="theme",
-        value=current_theme,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False,  # Allow non-HTTPS for local development
+
+
+def parse_form_rating(value: Optional[str]) -> Optional[int]:
+    """The rating picked in a book form: empty for no rating, otherwise 0 to 3"""
+    if not value:
+        return None
+    if value not in ("0", "1", "2", "3"):
+        raise HTTPException(status_code=422, detail="Rating must be between 0 and 3")
+    return int(value)
+
+
+def is_htmx_request(request: Request) -> bool:
+    """Check whether a request was issued by htmx rather than a full page load"""
+    return request.headers.get("HX-Request") == "true"
+
+
+def get_board_counts(db: Session, current_user: Optional[models.User]) -> dict:
+    """Get the number of books per status shown on the current user's board"""
+    if current_user:
+        summary = counters.get_summary(db, current_user.id)
+        return {status: getattr(summary, status) for status in counters.BOOK_STATUSES}
+
+    counts = dict.fromkeys(counters.BOOK_STATUSES, 0)
+    counts.update(
+        db.query(models.Book.status, func.count(models.Book.id))
+        .filter(models.Book.user_id.is_(None))
+        .group_by(models.Book.status)
+        .all()
+    )
+    return counts
+
+
+def render_board_update(
+    request: Request,
+    db: Session,
+    current_user: Optional[models.User],
+    book: Optional[models.Book] = None,
+    moved: bool = False,
+) -> HTMLResponse:
+    """Render the htmx response to a board write instead of the whole board.
+
+    The swap target receives the book card, or nothing when the book was
+    deleted or moved to another column. A moved book is appended to its new
+    column and the per-status counts are refreshed with out-of-band swaps.
+    """
+    return templates.TemplateResponse(
+        "partials/board_update.html",
+        {
+            "request": request,
+            "book": book,
+            "moved": moved,
+            "counts": get_board_counts(db, current_user),
+        },
     )
-    return response
 
 
 @app.get("/settings")
 def settings_page(request: Request):
-    theme, current_theme = get_current_theme(request)
+    _, current_theme = get_current_theme(request)
     # Create a dict of theme names and their colors
     theme_previews = {name: colors for name, colors in themes.THEMES.items()}
     # Sort themes alphabetically for consistent display
     theme_previews = dict(sorted(theme_previews.items()))
 
-    response = templates.TemplateResponse(
+    return templates.TemplateResponse(
         "settings.html",
         {
             "request": request,
             "theme_previews": theme_previews,
             "current_theme": current_theme,
-            "theme": theme,
         },
     )
-    set_theme_cookie(response, current_theme)
-    return response
 
 
 @app.post("/settings/theme")
@@ -219,25 +373,14 @@ def update_theme(request: Request, theme_name: str = Form(...)):
 
 @app.get("/add-book")
 def add_book_form(request: Request):
-    theme, current_theme = get_current_theme(request)
-    response = templates.TemplateResponse(
+    return templates.TemplateResponse(
         "book_form.html",
         {
             "request": request,
             "book": None,
-            "theme": theme,
-            "current_theme": current_theme,
+            "on_board": request.headers.get("HX-Target") == "add-book-slot",
         },
     )
-    response.set_cookie(
-        key="theme",
-        value=current_theme,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False,  # Allow non-HTTPS for local development
-    )
-    return response
 
 
 @app.get("/edit-book/{book_id}")
@@ -247,40 +390,110 @@ def edit_book_form(
     book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    theme, current_theme = get_current_theme(request)
-    response = templates.TemplateResponse(
+    return templates.TemplateResponse(
         "book_form.html",
         {
             "request": request,
             "book": book,
-            "theme": theme,
-            "current_theme": current_theme,
         },
     )
-    response.set_cookie(
-        key="theme",
-        value=current_theme,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False,  # Allow non-HTTPS for local development
-    )
-    return response
+
+
+@app.get("/ready")
+def readiness():
+    """200 once startup, warm-up included, has finished; 503 until then or if it failed"""
+    return JSONResponse(startup.state.report(), status_code=200 if startup.state.ready else 503)
+
+
+@app.get("/metrics")
+async def prometheus_metrics(reader: Optional[models.User] = Depends(auth.get_metrics_reader)):
+    """Process metrics in the Prometheus text format, for admins and the METRICS_TOKEN scraper"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # JSON API endpoints
 @app.get("/api/theme/{theme_name}", response_model=ThemeColors)
-def get_theme_colors(theme_name: str):
-    theme = themes.get_theme(theme_name)
+def get_theme_colors(request: Request, theme_name: str):
+    theme = themes.get_compiled_theme(theme_name)
     if not theme:
         raise HTTPException(status_code=404, detail=f"Theme '{theme_name}' not found")
-    return theme
+    headers = {"ETag": theme.etag, "Cache-Control": "public, no-cache"}
+    if etag_matches(request, theme.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(theme.json, media_type="application/json", headers=headers)
+
+
+@app.get("/themes/{filename}")
+def get_theme_stylesheet(filename: str):
+    """Serve a compiled theme stylesheet; its URL changes with its content"""
+    name, fingerprint, extension = (filename.rsplit(".", 2) + ["", ""])[:3]
+    theme = themes.get_compiled_theme(name)
+    if not theme or fingerprint != theme.fingerprint or extension != "css":
+        raise HTTPException(status_code=404, detail="Stylesheet not found")
+    return Response(
+        theme.css,
+        media_type="text/css",
+        headers={
+            "ETag": theme.etag,
+            "Cache-Control": "public, max-age=31536000, immutable",
+        },
+    )
 
 
-@app.get("/api/books/", response_model=List[Book])
-def list_books(db: Session = Depends(database.get_db)):
-    books = db.query(models.Book).all()
-    return books
+@app.get("/api/books/", response_model=BookPage)
+def list_books(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    status: Optional[schemas.BookStatus] = None,
+    rating: Optional[int] = Query(None, ge=0, le=3),
+    min_rating: Optional[int] = Query(None, ge=0, le=3),
+    author: Optional[str] = None,
+    started_after: Optional[datetime] = None,
+    started_before: Optional[datetime] = None,
+    completed_after: Optional[datetime] = None,
+    completed_before: Optional[datetime] = None,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """List the current user's books one keyset page at a time, ordered by id"""
+    etag = library_etag(request, db, current_user, request.url.query)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update({"ETag": etag, **CONDITIONAL_HEADERS})
+
+    query = db.query(models.Book).filter(models.Book.user_id == current_user.id)
+
+    if status is not None:
+        query = query.filter(models.Book.status == status.value)
+    if rating is not None:
+        query = query.filter(models.Book.rating == rating)
+    if min_rating is not None:
+        query = query.filter(models.Book.rating >= min_rating)
+    if author is not None:
+        query = query.filter(models.Book.author == author)
+    if started_after is not None:
+        query = query.filter(models.Book.start_date >= started_after)
+    if started_before is not None:
+        query = query.filter(models.Book.start_date < started_before)
+    if completed_after is not None:
+        query = query.filter(models.Book.completion_date >= completed_after)
+    if completed_before is not None:
+        query = query.filter(models.Book.completion_date < completed_before)
+
+    # Seek past the last row of the previous page instead of using OFFSET
+    if cursor:
+        query = query.filter(models.Book.id > decode_cursor(cursor))
+
+    # Fetch one extra row to find out whether another page exists
+    books = query.order_by(models.Book.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        next_cursor = encode_cursor(books[-1].id)
+
+    return {"items": books, "next_cursor": next_cursor}
 
 
 @app.post("/api/books/", response_model=Book)
@@ -299,11 +512,138 @@ def create_book_api(
 
     db_book = models.Book(**data)
     db.add(db_book)
+    counters.record_book_added(db, db_book)
     db.commit()
     db.refresh(db_book)
     return db_book
 
 
+@app.get("/api/books/search", response_model=List[SearchResult])
+def search_books_api(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """Search the current user's books by title, author and notes, best matches first"""
+    return [hit._asdict() for hit in search.search_books(db, q, current_user.id, limit)]
+
+
+@app.get("/search")
+def search_books_partial(
+    request: Request,
+    q: str = "",
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_current_user),
+):
+    """Search results for the board's search box"""
+    user_id = current_user.id if current_user else None
+    return templates.TemplateResponse(
+        "partials/search_results.html",
+        {"request": request, "query": q, "hits": search.search_books(db, q, user_id)},
+    )
+
+
+# Columns written by the library export, in order
+EXPORT_COLUMNS = [
+    "id", "title", "author", "status", "rating", "start_date", "completion_date", "notes"
+]
+# Rows fetched from the database cursor at a time by the export
+EXPORT_BATCH_SIZE = 500
+
+
+def export_rows(user_id: int):
+    """Yield a user's books as dicts, streaming them from a server-side cursor."""
+    columns = [getattr(models.Book, column) for column in EXPORT_COLUMNS]
+    query = (
+        select(*columns)
+        .where(models.Book.user_id == user_id)
+        .order_by(models.Book.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    with database.SessionLocal() as db:
+        for row in db.execute(query):
+            yield row._asdict()
+
+
+def export_ndjson(user_id: int):
+    for row in export_rows(user_id):
+        yield json.dumps(row, default=datetime.isoformat) + "\n"
+
+
+def export_csv(user_id: int):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in export_rows(user_id):
+        writer.writerow(
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in row.values()
+        )
+        # Hand each line over as soon as it is written instead of building the file
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+@app.get("/api/books/export")
+async def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: models.User = Depends(auth.get_current_user_async),
+):
+    """Stream the current user's whole library as NDJSON or CSV"""
+    if format == "csv":
+        body, media_type = export_csv(current_user.id), "text/csv"
+    else:
+        body, media_type = export_ndjson(current_user.id), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="books.{format}"'},
+    )
+
+
+# Books inserted and committed together by the CSV import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+
+@app.post("/api/books/import")
+async def import_books(
+    request: Request,
+    current_user: models.User = Depends(auth.get_current_user_async),
+):
+    """Import a Goodreads or StoryGraph CSV export uploaded as the 'file' field.
+
+    The response is NDJSON: an "error" line per skipped row, a "progress"
+    line after each committed batch and a final "done" line with totals.
+    """
+    # Parse the form here rather than with a File() parameter, which FastAPI
+    # closes before a streaming response has read it
+    form = await request.form()
+    upload = form.get("file")
+    if not isinstance(upload, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=400, detail="Upload the CSV export as the 'file' field")
+
+    try:
+        export = await run_in_threadpool(importers.open_export, upload.file)
+    except ValueError as e:
+        await form.close()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user_id = current_user.id
+
+    def events():
+        try:
+            with database.SessionLocal() as db:
+                for event in importers.import_books(db, export, user_id, IMPORT_BATCH_SIZE):
+                    yield json.dumps(event) + "\n"
+        finally:
+            upload.file.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @app.put("/api/books/{book_id}", response_model=Book)
 def update_book_api(
     book_id: int,
@@ -326,8 +666,10 @@ def update_book_api(
     if "rating" in data and data["rating"] == "":
         data["rating"] = None
 
+    before = counters.snapshot(db_book)
     for key, value in data.items():
         setattr(db_book, key, value)
+    counters.record_book_changed(db, before, db_book)
 
     db.commit()
     db.refresh(db_book)
@@ -351,88 +693,84 @@ def delete_book_api(
         )
 
     db.delete(db_book)
+    counters.record_book_removed(db, db_book)
     db.commit()
+    evict_book_card(book_id)
     return {"ok": True}
 
 
 # Template endpoints
 @app.get("/books/{book_id}")
-def get_book(request: Request, book_id: int, db: Session = Depends(database.get_db)):
+def get_book(
+    request: Request,
+    book_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_current_user),
+):
+    # Check if we should return the card or the form
+    format_param = request.query_params.get("format", "form")
+
     book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # Get theme information
-    theme, current_theme = get_current_theme(request)
-
-    # Check if we should return the card or the form
-    format_param = request.query_params.get("format", "form")
+    # ETags are only handed out for books on the viewer's board, whose
+    # library version changes whenever one of its books does
+    etag = None
+    if book.user_id == (current_user.id if current_user else None):
+        etag = library_etag(request, db, current_user, book_id, format_param)
+        if etag_matches(request, etag):
+            return not_modified(etag)
 
     if format_param == "card":
         # Return just the book card
-        context = {
-            "request": request,
-            "book": book,
-            "theme": theme,
-            "current_theme": current_theme,
-        }
-        return templates.TemplateResponse("partials/book_card.html", context)
+        response = HTMLResponse(render_book_card(book))
     else:
         # Return the edit form
-        return templates.TemplateResponse(
+        response = templates.TemplateResponse(
             "book_form.html",
             {
                 "request": request,
                 "book": book,
-                "theme": theme,
-                "current_theme": current_theme,
             },
         )
 
+    if etag is not None:
+        response.headers.update({"ETag": etag, **CONDITIONAL_HEADERS})
+    return response
+
 
 @app.post("/books/")
 def create_book(
     request: Request,
     title: str = Form(...),
     author: Optional[str] = Form(None),
-    status: str = Form(...),
+    status: schemas.BookStatus = Form(...),
     notes: Optional[str] = Form(None),
-    rating: Optional[int] = Form(None),
+    rating: Optional[str] = Form(None),
     db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_current_user),
 ):
     book_data = {
         "title": title,
         "author": author,
-        "status": status,
+        "status": status.value,
         "notes": notes,
-        "rating": rating if rating != "" else None,
+        "rating": parse_form_rating(rating),
+        "user_id": current_user.id if current_user else None,
     }
 
     db_book = models.Book(**book_data)
     db.add(db_book)
+    counters.record_book_added(db, db_book)
     db.commit()
     db.refresh(db_book)
 
-    books = db.query(models.Book).all()
-    theme, current_theme = get_current_theme(request)
-    response = templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "books": books,
-            "theme": theme,
-            "current_theme": current_theme,
-        },
-    )
-    response.set_cookie(
-        key="theme",
-        value=current_theme,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False,  # Allow non-HTTPS for local development
-    )
-    return response
+    # The form was opened on the board: close it and add the card to its column
+    if is_htmx_request(request) and request.headers.get("HX-Target") == "add-book-slot":
+        return render_board_update(request, db, current_user, db_book, moved=True)
+
+    return render_board(request, db, current_user)
 
 
 @app.put("/books/{book_id}")
@@ -441,10 +779,11 @@ def update_book(
     book_id: int,
     title: str = Form(...),
     author: Optional[str] = Form(None),
-    status: str = Form(...),
+    status: schemas.BookStatus = Form(...),
     notes: Optional[str] = Form(None),
-    rating: Optional[int] = Form(None),
+    rating: Optional[str] = Form(None),
     db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_current_user),
 ):
     db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if db_book is None:
@@ -453,76 +792,52 @@ def update_book(
     book_data = {
         "title": title,
         "author": author,
-        "status": status,
+        "status": status.value,
         "notes": notes,
-        "rating": rating if rating != "" else None,
+        "rating": parse_form_rating(rating),
     }
 
+    before = counters.snapshot(db_book)
     for key, value in book_data.items():
         setattr(db_book, key, value)
+    counters.record_book_changed(db, before, db_book)
 
     db.commit()
     db.refresh(db_book)
 
-    # Get all books for the full page refresh
-    books = db.query(models.Book).all()
-    theme, current_theme = get_current_theme(request)
-    response = templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "books": books,
-            "theme": theme,
-            "current_theme": current_theme,
-        },
-    )
-    response.set_cookie(
-        key="theme",
-        value=current_theme,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False,  # Allow non-HTTPS for local development
-    )
-    return response
+    if is_htmx_request(request):
+        moved = db_book.status != before.status
+        return render_board_update(request, db, current_user, db_book, moved=moved)
+
+    return render_board(request, db, current_user)
 
 
 @app.patch("/books/{book_id}/status")
 async def update_book_status(
     request: Request,
     book_id: int,
-    status: str = Form(...),
-    db: Session = Depends(database.get_db),
+    status: schemas.BookStatus = Form(...),
+    db: AsyncSession = Depends(database.get_async_db),
 ):
-    print(f"Updating book {book_id} status to {status}")
-
     # Find the book
-    db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
+    db_book = await db.get(models.Book, book_id)
     if db_book is None:
-        print(f"Book {book_id} not found")
+        logger.info("Book not found for status change", extra={"book_id": book_id})
         raise HTTPException(status_code=404, detail="Book not found")
 
     # Update the status
-    old_status = db_book.status
-    db_book.status = status
-    db.commit()
-    db.refresh(db_book)
-    print(f"Book {book_id} status updated from {old_status} to {status}")
+    before = counters.snapshot(db_book)
+    db_book.status = status.value
+    await db.run_sync(counters.record_book_changed, before, db_book)
+    await db.commit()
+    # Logged for a sample of drag-and-drops only, see LOG_SAMPLE_RATES
+    logger.info(
+        "Book status changed",
+        extra={"book_id": book_id, "from_status": before.status, "to_status": status.value, "sampled": True},
+    )
 
     # Return the updated book card
-    theme, current_theme = get_current_theme(request)
-
-    # Create context for template rendering
-    context = {
-        "request": request,
-        "book": db_book,
-        "theme": theme,
-        "current_theme": current_theme,
-    }
-
-    # Render the template directly
-    html_content = templates.get_template("partials/book_card.html").render(context)
-    print(f"Returning JSON response for book {book_id}")
+    html_content = render_book_card(db_book)
 
     # Return JSON with both HTML content and book data
     return JSONResponse(
@@ -541,32 +856,22 @@ async def update_book_status(
 
 
 @app.delete("/books/{book_id}")
-def delete_book(request: Request, book_id: int, db: Session = Depends(database.get_db)):
+def delete_book(
+    request: Request,
+    book_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_current_user),
+):
     db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
     if db_book is None:
         raise HTTPException(status_code=404, detail="Book not found")
 
     db.delete(db_book)
+    counters.record_book_removed(db, db_book)
     db.commit()
+    evict_book_card(book_id)
 
-    # Get all books for the full page refresh
-    books = db.query(models.Book).all()
-    theme, current_theme = get_current_theme(request)
-    response = templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "books": books,
-            "theme": theme,
-            "current_theme": current_theme,
-        },
-    )
-    response.set_cookie(
-        key="theme",
-        value=current_theme,
-        max_age=31536000,  # 1 year
-        httponly=False,  # Allow JavaScript to read the cookie
-        samesite="lax",
-        secure=False,  # Allow non-HTTPS for local development
-    )
-    return response
+    if is_htmx_request(request):
+        return render_board_update(request, db, current_user)
+
+    return render_board(request, db, current_user)
@@ -0,0 +1,317 @@
+"""ASGI middleware for the book tracking app."""
+import re
+import time
+import uuid
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request, cookie_parser
+from starlette.routing import Match
+
+from . import compression, instrumentation, logs, metrics, profiling
+
+http_request_seconds = metrics.REGISTRY.histogram(
+    "http_request_seconds", "Time from receiving a request to sending the last of its body", ["method", "route"]
+)
+http_requests = metrics.REGISTRY.counter(
+    "http_requests_total", "Requests handled, by response status", ["method", "route", "status"]
+)
+http_requests_in_progress = metrics.REGISTRY.gauge(
+    "http_requests_in_progress", "Requests being handled", ["method", "route"]
+)
+
+
+class CookieToAuthorizationMiddleware:
+    """Turn the access_token cookie into an Authorization: Bearer header.
+
+    Browser sessions keep the JWT in a cookie, while the OAuth2 dependencies
+    read the Authorization header. This is a plain ASGI middleware rather
+    than an @app.middleware("http") function, so it adds no per-request task
+    or response streaming and leaves requests that need no header untouched.
+    """
+
+    def __init__(self, app, cookie_name: str = "access_token", skip_prefixes=("/static",)):
+        self.app = app
+        self.cookie_name = cookie_name
+        self.cookie_marker = f"{cookie_name}=".encode("latin-1")
+        self.skip_prefixes = tuple(skip_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        # ASGI servers lowercase header names, so compare the raw bytes
+        cookie = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                await self.app(scope, receive, send)
+                return
+            if name == b"cookie":
+                cookie = value
+
+        if cookie is None or self.cookie_marker not in cookie:
+            await self.app(scope, receive, send)
+            return
+
+        token = cookie_parser(cookie.decode("latin-1")).get(self.cookie_name)
+        if token:
+            scope = dict(scope)
+            scope["headers"] = [
+                *scope["headers"],
+                (b"authorization", b"Bearer " + token.encode("latin-1")),
+            ]
+        await self.app(scope, receive, send)
+
+
+class CompressionMiddleware:
+    """Compress response bodies with the best encoding the client accepts.
+
+    Only responses of a compressible content type and at least minimum_size
+    bytes are compressed. Streamed responses are compressed chunk by chunk
+    and flushed as they go. Responses that already carry a Content-Encoding,
+    such as precompressed static files, pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = compression.negotiate(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressedResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send_wrapper)
+
+
+class CompressedResponder:
+    """Wraps send for one response, deciding on the first body chunk whether to compress."""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(raw=message["headers"])
+            self.passthrough = (
+                message["status"] < 200
+                or message["status"] in (204, 206, 304)
+                or "content-encoding" in headers
+                or not compression.is_compressible(headers.get("content-type"))
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                # Held back until the first body chunk shows how big the body is
+                self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            # Strong validators describe the uncompressed bytes, so weaken them
+            if "etag" in headers and not headers["etag"].startswith("W/"):
+                headers["ETag"] = "W/" + headers["etag"]
+            self.encoder = compression.Encoder(self.encoding)
+            if not more_body:
+                body = self.encoder.finish(body)
+                headers["Content-Length"] = str(len(body))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            del headers["Content-Length"]
+            await self.send(start)
+
+        if more_body:
+            await self.send(
+                {"type": "http.response.body", "body": self.encoder.compress(body), "more_body": True}
+            )
+        else:
+            await self.send({"type": "http.response.body", "body": self.encoder.finish(body)})
+
+
+def route_template(scope) -> str:
+    """The path template of the route a request goes to, such as /books/{book_id}.
+
+    Paths that match no route are reported together, so that scanners probing
+    random URLs do not create a time series per path.
+    """
+    app = scope.get("app")
+    if app is None:
+        return "unmatched"
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Record latency, status and in-flight count per method and route template.
+
+    The route is looked up against the app's routes up front rather than read
+    back from the scope afterwards, because middleware further in, such as
+    CookieToAuthorizationMiddleware, hand a copy of the scope to the router.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = scope.get("route_template") or route_template(scope)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc(method=method, route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_seconds.observe(time.perf_counter() - started, method=method, route=route)
+            http_requests.inc(method=method, route=route, status=str(status_code))
+            http_requests_in_progress.dec(method=method, route=route)
+
+
+class QueryCountMiddleware:
+    """Count the SQL queries of each request and report repeated ones.
+
+    Queries are counted through instrumentation.current_query_stats. With
+    DEV_MODE on, the count and the time spent in the database, in
+    milliseconds, are added to the response as X-DB-Query-Count and
+    X-DB-Time. Queries run while a streamed body is sent come after the
+    headers and are not included.
+    """
+
+    def __init__(self, app, headers: bool = False):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = instrumentation.QueryStats(f"{scope['method']} {scope['path']}")
+        token = instrumentation.current_query_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.headers:
+                headers = MutableHeaders(raw=message["headers"])
+                headers["X-DB-Query-Count"] = str(stats.count)
+                headers["X-DB-Time"] = f"{stats.seconds * 1000:.2f}"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            instrumentation.current_query_stats.reset(token)
+
+
+class ProfilingMiddleware:
+    """Answer admin requests carrying ?__profile=1 or X-Profile: 1 with a profile report.
+
+    The request runs as usual under profiling.profile_request, its response
+    is dropped, and render(request, profile) builds the response sent back
+    instead. For anyone but an admin the flag is ignored.
+    """
+
+    def __init__(self, app, render):
+        self.app = app
+        self.render = render
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiling.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        admin = await profiling.get_admin(scope)
+        if admin is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = await profiling.profile_request(self.app, scope, receive, admin)
+        response = self.render(Request(scope), profile, admin)
+        await response(scope, receive, send)
+
+
+class RequestContextMiddleware:
+    """Give each request an id and the logging context that carries it.
+
+    A well-formed X-Request-ID from the client or a proxy is kept, otherwise
+    a new id is made up, and either way it is echoed in the response. The
+    route template is also left in the scope as "route_template", for
+    MetricsMiddleware to reuse instead of matching the routes again.
+    """
+
+    valid_request_id = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None or not self.valid_request_id.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+
+        route = route_template(scope)
+        scope["route_template"] = route
+        token = logs.current_request.set(logs.start_request(request_id, route))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(raw=message["headers"])["X-Request-ID"] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            logs.current_request.reset(token)
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Enum, Text, DateTime, SmallInteger, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Enum, Text, DateTime, SmallInteger, ForeignKey, Boolean, Index, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import object_session, relationship
 
 Base = declarative_base()
 
@@ -11,7 +11,7 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
     role = Column(String(20), default="user", nullable=False)  # Options: 'user', 'admin'
     
     # Relationship with books
@@ -19,6 +19,14 @@ class User(Base):
 
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = (
+        Index("ix_books_user_id_id", "user_id", "id"),
+        Index("ix_books_user_id_status", "user_id", "status"),
+        Index("ix_books_status", "status"),
+        Index("ix_books_author", "author"),
+        # Never reuse the id of a deleted book, which cached book cards are keyed by
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
@@ -29,6 +37,39 @@ class Book(Base):
     completion_date = Column(DateTime, nullable=True)
     rating = Column(SmallInteger, nullable=True, comment='0: DNF, 1: Wouldn\'t read again, 2: Good but not recommendable, 3: Would recommend')
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # Bumped on every update, so rendered fragments can be cached per row version
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     
     # Relationship with user
     user = relationship("User", back_populates="books")
+
+@event.listens_for(Book, "before_update")
+def bump_book_version(mapper, connection, book):
+    """Give a book a new row version whenever one of its columns changes."""
+    if object_session(book).is_modified(book, include_collections=False):
+        book.version = (book.version or 0) + 1
+
+class Counter(Base):
+    __tablename__ = "counters"
+
+    name = Column(String(50), primary_key=True)  # e.g. 'users', 'books:reading'
+    value = Column(Integer, nullable=False, default=0)
+
+class ReadingSummary(Base):
+    __tablename__ = "reading_summaries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    to_read = Column(Integer, nullable=False, default=0)
+    reading = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    on_hold = Column(Integer, nullable=False, default=0)
+    dnf = Column(Integer, nullable=False, default=0)
+    rating_0 = Column(Integer, nullable=False, default=0)
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    last_completed_at = Column(DateTime, nullable=True)
+
+    @property
+    def total(self):
+        return self.to_read + self.reading + self.completed + self.on_hold + self.dnf
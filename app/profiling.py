@@ -0,0 +1,297 @@
+"""On-demand profiling of single requests, for admins.
+
+An admin adds ?__profile=1 to any URL, or sends an X-Profile: 1 header, and
+gets a report of that request instead of its response: a call tree and
+function table from cProfile, and what tracemalloc saw allocated. The last
+PROFILE_HISTORY reports are kept in memory and listed on the admin dashboard.
+
+cProfile follows every thread on Python 3.12, so the threadpool work of sync
+routes is included, and so is anything else the process runs meanwhile.
+Only one profiler can be active at a time, so profiled requests take turns.
+"""
+import asyncio
+import cProfile
+import itertools
+import os
+import pstats
+import sysconfig
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import HTTPException
+
+from . import auth, database, instrumentation, models
+
+# Reports kept for the admin dashboard
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "20"))
+# Call tree branches under this share of the request's time are left out
+TREE_MIN_SHARE = 0.005
+TREE_MAX_DEPTH = 60
+TREE_MAX_ROWS = 400
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+# Shortened out of file names in reports, site-packages before the stdlib it sits in
+_LIBRARY_PATHS = sorted(
+    {sysconfig.get_paths()[name] for name in ("purelib", "platlib", "stdlib")}, key=len, reverse=True
+)
+
+# cProfile's key for contextvars.Context.run
+_CONTEXT_RUN = ("~", 0, "<method 'run' of '_contextvars.Context' objects>")
+
+PROFILE_PARAMETER = "__profile"
+PROFILE_HEADER = b"x-profile"
+
+_profile_lock = asyncio.Lock()
+_profile_ids = itertools.count(1)
+
+
+@dataclass
+class FunctionStat:
+    name: str
+    location: str
+    calls: int
+    own_seconds: float
+    cumulative_seconds: float
+
+
+@dataclass
+class TreeRow:
+    depth: int
+    name: str
+    location: str
+    cumulative_seconds: float
+    share: float
+
+
+@dataclass
+class Allocation:
+    location: str
+    size: int
+    count: int
+
+
+@dataclass
+class Profile:
+    id: int
+    created_at: datetime
+    method: str
+    path: str
+    user_email: str
+    status: int = 500
+    response_bytes: int = 0
+    seconds: float = 0.0
+    query_count: int = 0
+    query_seconds: float = 0.0
+    memory_peak: int = 0
+    memory_retained: int = 0
+    error: Optional[str] = None
+    tree: List[TreeRow] = field(default_factory=list)
+    cumulative: List[FunctionStat] = field(default_factory=list)
+    own: List[FunctionStat] = field(default_factory=list)
+    allocations: List[Allocation] = field(default_factory=list)
+
+
+class ProfileStore:
+    """Ring buffer of the most recent profiles."""
+
+    def __init__(self, size: int):
+        self._profiles: "deque[Profile]" = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: int) -> Optional[Profile]:
+        with self._lock:
+            return next((p for p in self._profiles if p.id == profile_id), None)
+
+    def recent(self) -> List[Profile]:
+        """Profiles, newest first."""
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+profiles = ProfileStore(PROFILE_HISTORY)
+
+
+def wants_profile(scope) -> bool:
+    """Whether the request asks to be profiled, by query parameter or header."""
+    if PROFILE_PARAMETER.encode() in scope.get("query_string", b""):
+        query = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        if query.get(PROFILE_PARAMETER) not in (None, "", "0"):
+            return True
+    return any(name == PROFILE_HEADER and value not in (b"", b"0") for name, value in scope["headers"])
+
+
+def strip_profile_parameter(scope):
+    """A copy of scope without the __profile parameter, so the route sees its usual query."""
+    query = [
+        (name, value)
+        for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        if name != PROFILE_PARAMETER
+    ]
+    return {**scope, "query_string": urlencode(query).encode("latin-1")}
+
+
+async def get_admin(scope) -> Optional[models.User]:
+    """The admin making the request, or None if it is not made by an admin."""
+    token = None
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                token = None
+            break
+    if not token:
+        return None
+    async with database.AsyncSessionLocal() as db:
+        user = await auth.resolve_user_async(token, db)
+    if user is None:
+        return None
+    try:
+        return await auth.get_current_admin_user(user)
+    except HTTPException:
+        return None
+
+
+def _location(func: Tuple[str, int, str]) -> str:
+    """file:line of a cProfile function key, relative to the app, site-packages or stdlib."""
+    filename, line, _ = func
+    if filename == "~":
+        return "built-in"
+    for prefix in (os.getcwd(), *_LIBRARY_PATHS):
+        if filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    return f"{filename}:{line}"
+
+
+def _function_stats(stats: Dict, sort_index: int) -> List[FunctionStat]:
+    ranked = sorted(stats.items(), key=lambda item: item[1][sort_index], reverse=True)
+    return [
+        FunctionStat(func[2], _location(func), calls, own, cumulative)
+        for func, (_, calls, own, cumulative, _) in ranked[:TOP_FUNCTIONS]
+    ]
+
+
+def call_tree(stats: Dict, entry: Tuple[str, int, str], total: float) -> List[TreeRow]:
+    """Flatten cProfile's caller edges into an indented call tree, heaviest branches first.
+
+    The tree starts at the app's entry point and at every function run by
+    Context.run, which is how the event loop resumes coroutines and the
+    threadpool runs sync routes; cProfile sees those as called by
+    Context.run rather than by whoever awaited them. cProfile records who
+    called whom but not full stacks, so a function called from several
+    places shows its time split along those edges.
+    """
+    callees = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+    roots = {entry: stats[entry][3]} if entry in stats else {}
+    for func, cumulative in callees[_CONTEXT_RUN]:
+        roots[func] = max(roots.get(func, 0.0), cumulative)
+
+    rows: List[TreeRow] = []
+    minimum = total * TREE_MIN_SHARE
+
+    def walk(func, cumulative, depth, path):
+        if cumulative < minimum or depth > TREE_MAX_DEPTH or len(rows) >= TREE_MAX_ROWS:
+            return
+        rows.append(TreeRow(depth, func[2], _location(func), cumulative, cumulative / total if total else 0))
+        for child, child_cumulative in sorted(callees[func], key=lambda item: item[1], reverse=True):
+            if child not in path:
+                # Edges summed over several resumptions can exceed the parent
+                walk(child, min(child_cumulative, cumulative), depth + 1, path | {child})
+
+    for root, cumulative in sorted(roots.items(), key=lambda item: item[1], reverse=True):
+        walk(root, cumulative, 0, {root, _CONTEXT_RUN})
+    return rows
+
+
+def _entry_point(app) -> Tuple[str, int, str]:
+    """The cProfile key of the app's __call__, where the profiled request starts."""
+    code = type(app).__call__.__code__
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+def _allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> List[Allocation]:
+    ignored = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ]
+    differences = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")
+    return [
+        Allocation(f"{_location((frame.filename, frame.lineno, ''))}", diff.size_diff, diff.count_diff)
+        for diff in differences[:TOP_ALLOCATIONS]
+        if diff.size_diff > 0
+        for frame in diff.traceback[:1]
+    ]
+
+
+async def profile_request(app, scope, receive, admin: models.User) -> Profile:
+    """Run a request under cProfile and tracemalloc, discarding its response."""
+    scope = strip_profile_parameter(scope)
+    query = scope["query_string"].decode("latin-1")
+    profile = Profile(
+        id=next(_profile_ids),
+        created_at=datetime.now(),
+        method=scope["method"],
+        path=scope["path"] + (f"?{query}" if query else ""),
+        user_email=admin.email,
+    )
+
+    async def capture(message):
+        if message["type"] == "http.response.start":
+            profile.status = message["status"]
+        elif message["type"] == "http.response.body":
+            profile.response_bytes += len(message.get("body", b""))
+
+    async with _profile_lock:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        snapshot_before = tracemalloc.take_snapshot()
+        query_stats = instrumentation.current_query_stats.get()
+        queries_before = (query_stats.count, query_stats.seconds) if query_stats else (0, 0.0)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await app(scope, receive, capture)
+        except Exception as e:
+            profile.error = repr(e)
+        finally:
+            profiler.disable()
+            profile.seconds = time.perf_counter() - started
+
+        memory_after, memory_peak = tracemalloc.get_traced_memory()
+        snapshot_after = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+
+    profile.memory_peak = memory_peak - memory_before
+    profile.memory_retained = memory_after - memory_before
+    if query_stats:
+        profile.query_count = query_stats.count - queries_before[0]
+        profile.query_seconds = query_stats.seconds - queries_before[1]
+
+    stats = pstats.Stats(profiler).stats
+    profile.tree = call_tree(stats, _entry_point(app), profile.seconds)
+    profile.cumulative = _function_stats(stats, 3)
+    profile.own = _function_stats(stats, 2)
+    profile.allocations = _allocations(snapshot_before, snapshot_after)
+    profiles.add(profile)
+    return profile
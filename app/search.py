@@ -0,0 +1,210 @@
+"""Full-text search over book titles, authors and notes.
+
+On SQLite the books are indexed by an FTS5 table kept in sync with the
+books table by triggers. Each row also carries an owner token, so a search
+only considers the books of one board without filtering the results
+afterwards. Other databases, and SQLite builds without FTS5, fall back to a
+LIKE query without ranking.
+"""
+import logging
+import re
+from typing import List, NamedTuple, Optional
+
+from markupsafe import Markup, escape
+from sqlalchemy import or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# The FTS5 table reads its content through this view, which adds the owner token
+SEARCH_DDL = [
+    """
+    CREATE VIEW IF NOT EXISTS books_search_source AS
+    SELECT id, title, author, notes, coalesce('u' || user_id, 'anonymous') AS owner
+    FROM books
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, notes, owner,
+        content='books_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, notes, owner)
+        VALUES (new.id, new.title, new.author, new.notes, coalesce('u' || new.user_id, 'anonymous'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, notes, owner)
+        VALUES ('delete', old.id, old.title, old.author, old.notes, coalesce('u' || old.user_id, 'anonymous'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, notes, user_id ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, notes, owner)
+        VALUES ('delete', old.id, old.title, old.author, old.notes, coalesce('u' || old.user_id, 'anonymous'));
+        INSERT INTO books_fts(rowid, title, author, notes, owner)
+        VALUES (new.id, new.title, new.author, new.notes, coalesce('u' || new.user_id, 'anonymous'));
+    END
+    """,
+]
+
+# Relative weight of a match in title, author, notes and owner
+BM25_WEIGHTS = "10.0, 5.0, 1.0, 0.0"
+
+# Private-use markers around matches, replaced with <mark> once the text is escaped
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+SEARCH_SQL = f"""
+    SELECT rowid AS id,
+           highlight(books_fts, 0, :start, :end) AS title,
+           highlight(books_fts, 1, :start, :end) AS author,
+           snippet(books_fts, 2, :start, :end, '…', 12) AS snippet
+    FROM books_fts
+    WHERE books_fts MATCH :match
+    ORDER BY bm25(books_fts, {BM25_WEIGHTS})
+    LIMIT :limit
+"""
+
+fts_enabled = False
+
+
+class SearchHit(NamedTuple):
+    book: models.Book
+    title_html: Markup
+    author_html: Optional[Markup]
+    snippet_html: Optional[Markup]
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """Create the FTS5 table and its triggers if missing, indexing existing books.
+
+    Returns:
+        bool: Whether full-text search is available on this database
+    """
+    global fts_enabled
+    if engine.dialect.name != "sqlite":
+        fts_enabled = False
+        return False
+
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+        ).first()
+        try:
+            for statement in SEARCH_DDL:
+                connection.execute(text(statement))
+        except OperationalError as e:
+            logger.warning(f"Full-text search is disabled, FTS5 is not available: {e}")
+            fts_enabled = False
+            return False
+        if not exists:
+            connection.execute(text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+            logger.info("Built the full-text search index")
+
+    fts_enabled = True
+    return True
+
+
+def drop_search_index(engine: Engine) -> None:
+    """Drop the FTS5 table and its triggers, before a bulk load for instance.
+
+    ensure_search_index creates them again and indexes every book in one pass,
+    which is much faster than the triggers indexing the books one at a time.
+    """
+    global fts_enabled
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        for trigger in ("books_fts_insert", "books_fts_delete", "books_fts_update"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        connection.execute(text("DROP TABLE IF EXISTS books_fts"))
+    fts_enabled = False
+
+
+def owner_token(user_id: Optional[int]) -> str:
+    """The token that marks the books of a user, or of the anonymous board, in the index."""
+    return f"u{user_id}" if user_id is not None else "anonymous"
+
+
+def match_expression(query: str, user_id: Optional[int]) -> Optional[str]:
+    """Build an FTS5 query matching every word of query as a prefix, on one board.
+
+    User input is reduced to words and quoted, so FTS5 operators typed into
+    the search box are searched for rather than interpreted.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return None
+    words = " ".join(f'"{term}"*' for term in terms)
+    return f"owner:{owner_token(user_id)} AND {{title author notes}} : ({words})"
+
+
+def to_html(value: Optional[str]) -> Optional[Markup]:
+    """Escape highlighted text and turn the match markers into <mark> tags."""
+    if value is None:
+        return None
+    escaped = str(escape(value))
+    return Markup(escaped.replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
+
+
+def search_books(db: Session, query: str, user_id: Optional[int], limit: int = 20) -> List[SearchHit]:
+    """Return the books on a board matching query, best matches first."""
+    if not fts_enabled:
+        return _search_books_like(db, query, user_id, limit)
+
+    match = match_expression(query, user_id)
+    if match is None:
+        return []
+    rows = db.execute(
+        text(SEARCH_SQL),
+        {"match": match, "start": MATCH_START, "end": MATCH_END, "limit": limit},
+    ).all()
+    if not rows:
+        return []
+
+    books = {
+        book.id: book
+        for book in db.query(models.Book).filter(models.Book.id.in_([row.id for row in rows]))
+    }
+    return [
+        SearchHit(
+            books[row.id],
+            to_html(row.title),
+            to_html(row.author),
+            to_html(row.snippet) if MATCH_START in (row.snippet or "") else None,
+        )
+        for row in rows
+        if row.id in books
+    ]
+
+
+def _search_books_like(db: Session, query: str, user_id: Optional[int], limit: int) -> List[SearchHit]:
+    """Substring search for databases without FTS5."""
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return []
+    books = db.query(models.Book).filter(
+        models.Book.user_id == user_id if user_id is not None else models.Book.user_id.is_(None)
+    )
+    for term in terms:
+        pattern = f"%{term}%"
+        books = books.filter(
+            or_(
+                models.Book.title.ilike(pattern),
+                models.Book.author.ilike(pattern),
+                models.Book.notes.ilike(pattern),
+            )
+        )
+    return [
+        SearchHit(book, to_html(book.title), to_html(book.author), None)
+        for book in books.order_by(models.Book.title).limit(limit)
+    ]
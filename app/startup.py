@@ -0,0 +1,231 @@
+"""Everything the app prepares once before and just after it starts serving.
+
+The FastAPI lifespan runs run_startup: the schema check, migrations, the
+default admin, the dashboard counters, the search index and the static
+asset manifest, which requests depend on, before the server accepts
+connections; then, in the background, the warm-up phases that only make
+the first requests faster. GET /ready answers 503 until both are done.
+
+`python -m app.startup` runs the same phases without serving, to prepare
+a database ahead of a deploy.
+
+Each phase is timed, logged and listed by /ready.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+# alembic logs every plugin it loads on import; only its migration messages are of interest
+logging.getLogger("alembic.runtime.plugins").setLevel(logging.WARNING)
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from jinja2 import Environment
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from . import assets, auth, compression, counters, database, models, search
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@example.com")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "adminpassword")
+
+
+class StartupState:
+    """Progress of startup, as reported by /ready."""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error = f"{name}: {e!r}"
+            logger.exception("Startup phase failed", extra={"phase": name})
+            raise
+        seconds = time.perf_counter() - started
+        self.phases[name] = seconds
+        logger.info(f"Startup phase {name} took {seconds * 1000:.1f} ms", extra={"phase": name, "seconds": seconds})
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+
+state = StartupState()
+
+
+def alembic_config() -> Config:
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    # Keep the app's logging setup instead of the one in alembic.ini
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def prepare_schema(config: Config) -> bool:
+    """Create the schema of a new database, stamped as fully migrated.
+
+    Returns:
+        bool: Whether the database already had tables, and may need migrating
+    """
+    existing = set(inspect(database.engine).get_table_names())
+    if not existing & set(models.Base.metadata.tables):
+        models.Base.metadata.create_all(bind=database.engine)
+        command.stamp(config, "head")
+        return False
+    # Tables added to the models before migrations existed for them
+    models.Base.metadata.create_all(bind=database.engine, checkfirst=True)
+    return True
+
+
+def run_migrations(config: Config) -> None:
+    """Upgrade to the latest migration, skipping alembic's environment when already there."""
+    head = ScriptDirectory.from_config(config).get_current_head()
+    with database.engine.connect() as connection:
+        current = MigrationContext.configure(connection).get_current_revision()
+    if current == head:
+        return
+    logger.info(f"Migrating the database from {current} to {head}")
+    command.upgrade(config, "head")
+
+
+def migrate_schema() -> None:
+    """Bring the database to the latest migration, creating it if it is new."""
+    config = alembic_config()
+    if prepare_schema(config):
+        run_migrations(config)
+
+
+def seed_admin(db: Session, email: str, password: str) -> str:
+    """Make sure the user with this email exists and is an admin.
+
+    Returns:
+        str: "created", "promoted" or "exists"
+    """
+    existing_user = db.query(models.User).filter(models.User.email == email).first()
+    if existing_user:
+        if existing_user.role == "admin":
+            return "exists"
+        existing_user.role = "admin"
+        db.commit()
+        auth.identity_cache.invalidate_user(existing_user.id)
+        return "promoted"
+
+    # Build the counters first so the new admin is counted on top of them
+    counters.ensure_initialized(db)
+    db.add(
+        models.User(
+            email=email,
+            hashed_password=auth.get_password_hash(password),
+            is_active=True,
+            created_at=datetime.utcnow(),
+            role="admin",
+        )
+    )
+    counters.record_user_added(db)
+    db.commit()
+    return "created"
+
+
+def prepare() -> None:
+    """The phases requests depend on: run before the server accepts connections."""
+    config = alembic_config()
+    with state.phase("schema"):
+        if database.engine.dialect.name == "sqlite":
+            logger.info(f"SQLite settings: {database.sqlite_settings(database.engine)}")
+        migrate = prepare_schema(config)
+    if migrate:
+        with state.phase("migrations"):
+            run_migrations(config)
+    with state.phase("admin"), database.SessionLocal() as db:
+        if seed_admin(db, ADMIN_EMAIL, ADMIN_PASSWORD) == "created":
+            logger.info(f"Created the default admin user {ADMIN_EMAIL}")
+    with state.phase("counters"), database.SessionLocal() as db:
+        counters.ensure_initialized(db)
+    with state.phase("search_index"):
+        search.ensure_search_index(database.engine)
+    with state.phase("static_manifest"):
+        assets.static_assets.build()
+
+
+def warm_up(template_envs: Iterable[Environment]) -> None:
+    """The phases that only make the first requests faster."""
+    with state.phase("precompress"):
+        compression.precompress_directory(assets.STATIC_DIRECTORY)
+    with state.phase("templates"):
+        # Compile every template now rather than on its first request
+        for env in template_envs:
+            for name in env.list_templates(extensions=["html"]):
+                env.get_template(name)
+    with state.phase("sync_pool"), database.engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+
+
+async def warm_up_async_pool() -> None:
+    with state.phase("async_pool"):
+        async with database.async_engine.connect() as connection:
+            await connection.exec_driver_sql("SELECT 1")
+
+
+async def run_startup(template_envs: Iterable[Environment], background: bool = True) -> Optional[asyncio.Task]:
+    """Run startup for the lifespan: prepare now, warm up in a background task if background.
+
+    Returns:
+        asyncio.Task: The warm-up task, for the lifespan to cancel on shutdown
+    """
+    started = time.perf_counter()
+    prepare()
+
+    async def finish():
+        await asyncio.to_thread(warm_up, template_envs)
+        await warm_up_async_pool()
+        state.ready = True
+        logger.info(
+            f"Startup finished in {(time.perf_counter() - started) * 1000:.1f} ms",
+            extra={"phases_ms": state.report()["phases_ms"]},
+        )
+
+    if not background:
+        await finish()
+        return None
+
+    async def finish_in_background():
+        try:
+            await finish()
+        except Exception:
+            pass  # Logged and kept in state.error by the failing phase; /ready stays 503
+
+    return asyncio.create_task(finish_in_background())
+
+
+if __name__ == "__main__":
+    from .main import templates
+    from .auth_routes import templates as auth_templates
+    from .admin_routes import templates as admin_templates
+
+    async def main():
+        await run_startup([templates.env, auth_templates.env, admin_templates.env], background=False)
+        # Close the aiosqlite connection threads, or the interpreter waits on them
+        await database.async_engine.dispose()
+
+    asyncio.run(main())
+    for name, seconds in state.phases.items():
+        print(f"{name:16} {seconds * 1000:9.1f} ms")
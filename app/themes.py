@@ -1,6 +1,14 @@
-"""Theme management for the book tracking app."""
-from dataclasses import dataclass
-from typing import Dict, Optional
+"""Theme management for the book tracking app.
+
+Each theme is compiled once into a small stylesheet of CSS variables and a
+JSON document. Both are named and tagged by a hash of their content, so
+browsers can cache them forever and pages only need to reference the
+stylesheet's URL instead of embedding the theme's colors.
+"""
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from typing import Dict, NamedTuple, Optional
 
 @dataclass
 class ThemeColors:
@@ -88,3 +96,77 @@ THEMES: Dict[str, ThemeColors] = {
 def get_theme(name: str) -> Optional[ThemeColors]:
     """Get a theme by name."""
     return THEMES.get(name)
+
+
+# Theme used when the theme cookie is missing or names an unknown theme
+DEFAULT_THEME = "gruvbox-dark"
+
+
+class CompiledTheme(NamedTuple):
+    """A theme's stylesheet and JSON colors, ready to be served as they are."""
+    name: str
+    css: bytes
+    json: bytes
+    fingerprint: str
+
+    @property
+    def stylesheet_url(self) -> str:
+        return f"/themes/{self.name}.{self.fingerprint}.css"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.fingerprint}"'
+
+
+def hex_to_rgb(color: str) -> str:
+    """Turn "#rrggbb" into "r, g, b", for use inside rgba()."""
+    color = color.lstrip("#")
+    return ", ".join(str(int(color[i:i + 2], 16)) for i in (0, 2, 4))
+
+
+def theme_css(name: str, colors: ThemeColors) -> str:
+    """The CSS variables of a theme, plus an -rgb variant of each color."""
+    lines = [f"/* Theme: {name} */", ":root {"]
+    for key, value in asdict(colors).items():
+        lines.append(f"  --theme-{key}: {value};")
+        lines.append(f"  --theme-{key}-rgb: {hex_to_rgb(value)};")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def compile_theme(name: str, colors: ThemeColors) -> CompiledTheme:
+    css = theme_css(name, colors).encode()
+    return CompiledTheme(
+        name=name,
+        css=css,
+        json=json.dumps(asdict(colors)).encode(),
+        fingerprint=hashlib.sha256(css).hexdigest()[:12],
+    )
+
+
+def compile_themes() -> Dict[str, CompiledTheme]:
+    """Compile every built-in theme."""
+    return {name: compile_theme(name, colors) for name, colors in THEMES.items()}
+
+
+COMPILED_THEMES = compile_themes()
+
+# Changes whenever any theme stylesheet does, and with it the URLs pages carry
+THEMES_FINGERPRINT = hashlib.sha256(
+    "".join(theme.fingerprint for theme in COMPILED_THEMES.values()).encode()
+).hexdigest()[:16]
+
+
+def get_compiled_theme(name: str) -> Optional[CompiledTheme]:
+    """Get a compiled theme by name."""
+    return COMPILED_THEMES.get(name)
+
+
+def template_globals() -> Dict:
+    """Globals that let base.html pick the stylesheet of the visitor's theme."""
+    return {
+        "default_theme": DEFAULT_THEME,
+        "theme_stylesheets": {
+            name: theme.stylesheet_url for name, theme in COMPILED_THEMES.items()
+        },
+    }
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """
 Script to create a default admin user for the Book Tracking application.
-This script can be used standalone or during container startup.
+The app does this itself on startup (see app/startup.py); this script is
+for adding or promoting an admin by hand, on a database the app has
+already prepared.
 
 Environment variables:
 - ADMIN_EMAIL: Email for the admin user (default: admin@example.com)
@@ -10,8 +12,6 @@ Environment variables:
 
 import os
 import sys
-from datetime import datetime
-from sqlalchemy.orm import Session
 
 # Get admin credentials from environment variables or use defaults
 EMAIL = os.environ.get("ADMIN_EMAIL", "admin@example.com")
@@ -20,14 +20,12 @@ PASSWORD = os.environ.get("ADMIN_PASSWORD", "adminpassword")
 # Import app modules
 try:
     from app.database import SessionLocal
-    from app.models import User
-    from app.auth import get_password_hash
+    from app.startup import seed_admin
 except ImportError:
     # If running from a different directory, add the app directory to the path
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from app.database import SessionLocal
-    from app.models import User
-    from app.auth import get_password_hash
+    from app.startup import seed_admin
 
 
 def create_default_admin(quiet=False):
@@ -42,39 +40,17 @@ def create_default_admin(quiet=False):
     """
     db = SessionLocal()
     try:
-        # Check if user already exists
-        existing_user = db.query(User).filter(User.email == EMAIL).first()
-        if existing_user:
-            if not quiet:
+        result = seed_admin(db, EMAIL, PASSWORD)
+        if not quiet:
+            if result == "created":
+                print(f"Default admin user created successfully!")
+                print(f"Login with: {EMAIL} / {PASSWORD}")
+            elif result == "promoted":
                 print(f"User with email {EMAIL} already exists.")
-
-            # If user exists but is not admin, update role to admin
-            if existing_user.role != "admin":
-                existing_user.role = "admin"
-                db.commit()
-                if not quiet:
-                    print(f"Updated user {EMAIL} to admin role.")
+                print(f"Updated user {EMAIL} to admin role.")
             else:
-                if not quiet:
-                    print(f"User {EMAIL} is already an admin.")
-
-            return True
-
-        # Create new admin user
-        hashed_password = get_password_hash(PASSWORD)
-        new_user = User(
-            email=EMAIL,
-            hashed_password=hashed_password,
-            is_active=True,
-            created_at=datetime.utcnow(),
-            role="admin",
-        )
-
-        db.add(new_user)
-        db.commit()
-        if not quiet:
-            print(f"Default admin user created successfully!")
-            print(f"Login with: {EMAIL} / {PASSWORD}")
+                print(f"User with email {EMAIL} already exists.")
+                print(f"User {EMAIL} is already an admin.")
 
         return True
 
@@ -0,0 +1,34 @@
+"""add indexes for per-user, per-status and per-author book queries
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Fresh databases already get these from create_all, so skip existing ones
+    op.create_index('ix_books_user_id_id', 'books', ['user_id', 'id'], if_not_exists=True)
+    op.create_index('ix_books_user_id_status', 'books', ['user_id', 'status'], if_not_exists=True)
+    op.create_index('ix_books_status', 'books', ['status'], if_not_exists=True)
+    op.create_index('ix_books_author', 'books', ['author'], if_not_exists=True)
+    op.create_index('ix_users_created_at', 'users', ['created_at'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_created_at', table_name='users', if_exists=True)
+    op.drop_index('ix_books_author', table_name='books', if_exists=True)
+    op.drop_index('ix_books_status', table_name='books', if_exists=True)
+    op.drop_index('ix_books_user_id_status', table_name='books', if_exists=True)
+    op.drop_index('ix_books_user_id_id', table_name='books', if_exists=True)
@@ -0,0 +1,45 @@
+"""add reading_summaries table for per-user profile statistics
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Fresh databases already get this table from create_all
+    if 'reading_summaries' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    # Rows are built from a recount the first time each user's summary is used
+    op.create_table(
+        'reading_summaries',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('to_read', sa.Integer(), nullable=False),
+        sa.Column('reading', sa.Integer(), nullable=False),
+        sa.Column('completed', sa.Integer(), nullable=False),
+        sa.Column('on_hold', sa.Integer(), nullable=False),
+        sa.Column('dnf', sa.Integer(), nullable=False),
+        sa.Column('rating_0', sa.Integer(), nullable=False),
+        sa.Column('rating_1', sa.Integer(), nullable=False),
+        sa.Column('rating_2', sa.Integer(), nullable=False),
+        sa.Column('rating_3', sa.Integer(), nullable=False),
+        sa.Column('last_completed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('reading_summaries')
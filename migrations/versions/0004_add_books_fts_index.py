@@ -0,0 +1,73 @@
+"""add FTS5 full-text search index over book titles, authors and notes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # FTS5 is SQLite only; other databases fall back to a LIKE search
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    # The app creates the index on startup, so it may already be here
+    if 'books_fts' in sa.inspect(bind).get_table_names():
+        return
+
+    op.execute("""
+        CREATE VIEW IF NOT EXISTS books_search_source AS
+        SELECT id, title, author, notes, coalesce('u' || user_id, 'anonymous') AS owner
+        FROM books
+    """)
+    op.execute("""
+        CREATE VIRTUAL TABLE books_fts USING fts5(
+            title, author, notes, owner,
+            content='books_search_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts(rowid, title, author, notes, owner)
+            VALUES (new.id, new.title, new.author, new.notes, coalesce('u' || new.user_id, 'anonymous'));
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, notes, owner)
+            VALUES ('delete', old.id, old.title, old.author, old.notes, coalesce('u' || old.user_id, 'anonymous'));
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, notes, user_id ON books BEGIN
+            INSERT INTO books_fts(books_fts, rowid, title, author, notes, owner)
+            VALUES ('delete', old.id, old.title, old.author, old.notes, coalesce('u' || old.user_id, 'anonymous'));
+            INSERT INTO books_fts(rowid, title, author, notes, owner)
+            VALUES (new.id, new.title, new.author, new.notes, coalesce('u' || new.user_id, 'anonymous'));
+        END
+    """)
+    # Index the books that are already there
+    op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TRIGGER IF EXISTS books_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS books_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS books_fts_insert")
+    op.execute("DROP TABLE IF EXISTS books_fts")
+    op.execute("DROP VIEW IF EXISTS books_search_source")
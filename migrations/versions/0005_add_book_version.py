@@ -0,0 +1,35 @@
+"""add books.version row version for fragment caching
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Fresh databases already get the column from create_all
+    columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('books')]
+    if 'version' in columns:
+        return
+    op.add_column(
+        'books',
+        sa.Column('version', sa.Integer(), nullable=False, server_default='1'),
+    )
+
+
+def downgrade() -> None:
+    # A plain DROP COLUMN (SQLite 3.35+) keeps the full-text search triggers,
+    # which a batch table rebuild would drop along with the old table
+    op.drop_column('books', 'version')
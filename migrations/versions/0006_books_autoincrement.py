@@ -0,0 +1,57 @@
+"""never reuse book ids, which cached book cards are keyed by
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_TRIGGERS = ('books_fts_insert', 'books_fts_delete', 'books_fts_update')
+
+
+def upgrade() -> None:
+    # Other databases never hand out a sequence value twice anyway
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    # Fresh databases already get AUTOINCREMENT from create_all
+    books_sql = bind.execute(
+        sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'books'")
+    ).scalar()
+    if 'AUTOINCREMENT' in books_sql.upper():
+        return
+
+    # SQLite can only add AUTOINCREMENT by rebuilding the table, which the
+    # search view and triggers would not survive. Rows keep their ids, so
+    # the FTS5 index stays valid; the app creates the view and triggers
+    # again on startup (search.ensure_search_index).
+    for trigger in SEARCH_TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP VIEW IF EXISTS books_search_source')
+    with op.batch_alter_table(
+        'books', recreate='always', table_kwargs={'sqlite_autoincrement': True}
+    ) as batch_op:
+        pass
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in SEARCH_TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP VIEW IF EXISTS books_search_source')
+    with op.batch_alter_table(
+        'books', recreate='always', table_kwargs={'sqlite_autoincrement': False}
+    ) as batch_op:
+        pass
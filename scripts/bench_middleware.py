@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Measure the per-request overhead of the cookie-to-Authorization middleware.
+
+The previous implementation, an @app.middleware("http") function built on
+BaseHTTPMiddleware, is reproduced below and compared with
+app.middleware.CookieToAuthorizationMiddleware. Each variant wraps the same
+trivial Starlette app and is driven directly through the ASGI interface, so
+the numbers exclude the server and the network and show only what the
+middleware itself costs.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.middleware import CookieToAuthorizationMiddleware  # noqa: E402
+
+TOKEN = "eyJhbGciOiJIUzI1NiJ9.eyJzdWIiOiJ1c2VyQGV4YW1wbGUuY29tIn0.signature"
+
+CASES = {
+    "cookie": ("/books", [(b"cookie", f"theme=dracula; access_token={TOKEN}".encode())]),
+    "no cookie": ("/books", [(b"cookie", b"theme=dracula")]),
+    "bearer header": ("/api/books/", [(b"authorization", f"Bearer {TOKEN}".encode())]),
+    "static": ("/static/app.css", [(b"cookie", f"access_token={TOKEN}".encode())]),
+}
+
+
+async def endpoint(request):
+    return PlainTextResponse(request.headers.get("authorization", ""))
+
+
+def build_app():
+    return Starlette(routes=[Route("/{path:path}", endpoint)])
+
+
+async def cookie_to_authorization(request, call_next):
+    """The middleware as it was before it became a plain ASGI class."""
+    token = request.cookies.get("access_token")
+
+    has_auth_header = False
+    for k, v in request.scope.get("headers", []):
+        if k.decode().lower() == "authorization":
+            has_auth_header = True
+            break
+
+    if token and not has_auth_header:
+        headers = list(request.scope.get("headers", []))
+        auth_value = f"Bearer {token}"
+        headers.append((b"authorization", auth_value.encode()))
+        request.scope["headers"] = headers
+
+    response = await call_next(request)
+    return response
+
+
+def build_variants():
+    return {
+        "none": build_app(),
+        "BaseHTTPMiddleware": BaseHTTPMiddleware(build_app(), dispatch=cookie_to_authorization),
+        "ASGI": CookieToAuthorizationMiddleware(build_app()),
+    }
+
+
+async def call(app, path, headers):
+    """Send one GET request through an ASGI app and return its response body."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": list(headers),
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def bench(app, path, headers, requests):
+    """Return the mean time per request in microseconds."""
+    for _ in range(min(requests, 200)):
+        await call(app, path, headers)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call(app, path, headers)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+async def main(requests, repeat):
+    variants = build_variants()
+
+    # Both implementations must hand the endpoint the same header
+    for case, (path, headers) in CASES.items():
+        if path.startswith("/static"):
+            continue
+        expected = await call(variants["BaseHTTPMiddleware"], path, headers)
+        actual = await call(variants["ASGI"], path, headers)
+        if expected != actual:
+            print(f"{case}: ASGI middleware sent {actual!r}, expected {expected!r}")
+            return 1
+
+    print(f"{'case':<15} {'variant':<20} {'us/request':>12} {'overhead':>10}")
+    for case, (path, headers) in CASES.items():
+        results = {}
+        for name, app in variants.items():
+            results[name] = min([await bench(app, path, headers, requests) for _ in range(repeat)])
+        for name, elapsed in results.items():
+            overhead = elapsed - results["none"]
+            print(f"{case:<15} {name:<20} {elapsed:>12.1f} {overhead:>+10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cookie-to-Authorization middleware")
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="Measurements per variant, best one is reported")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.requests, args.repeat)))
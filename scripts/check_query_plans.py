@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Run EXPLAIN QUERY PLAN over the queries the app's routes issue and fail if
+any of them falls back to a full table scan.
+
+Rather than keeping copies of the routes' SQL, the script starts the app
+in-process against a fresh SQLite database in a temporary directory and
+sends a fixed walk-through of requests through it (see walk_through).
+Every SELECT, UPDATE and DELETE run while a request is handled, on the
+sync and the async engine alike, is recorded with its route and explained
+afterwards with the parameters it ran with. A change to a route's query is
+therefore checked as soon as it is made; when you add a route, add a
+request for it to the walk-through so that a missing index shows up before
+it reaches production.
+
+The app does not need to be running.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+import httpx
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READER_EMAIL = "reader@example.com"
+READER_PASSWORD = "readerpassword"
+
+# Routes that read every row on purpose
+ALLOWED_FULL_SCANS = {
+    "GET /admin/users": "lists every user",
+    "GET /admin/stats": "counts the books of every user",
+    "POST /admin/counters/reconcile": "recounts every user and book",
+}
+
+# Statement kinds whose plans can fall back to a table scan
+CHECKED_STATEMENTS = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+IMPORT_CSV = (
+    "Book Id,Title,Author,My Rating,Exclusive Shelf,Date Read,My Review,Private Notes\n"
+    "1,The Dispossessed,Ursula K. Le Guin,5,read,2024/03/01,,\n"
+    "2,Piranesi,Susanna Clarke,0,to-read,,,\n"
+)
+
+# "METHOD /route/{template}" of the request being handled
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+
+class StatementRecorder:
+    """Collect the distinct statements run per route, with the first parameters seen."""
+
+    def __init__(self):
+        self.statements: Dict[Tuple[str, str], tuple] = {}
+
+    def before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        route = current_route.get()
+        if route is None or executemany:
+            return
+        if not statement.lstrip().upper().startswith(CHECKED_STATEMENTS):
+            return
+        self.statements.setdefault((route, statement), tuple(parameters or ()))
+
+    def listen(self, engine) -> None:
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+
+
+def traced(app, route_template):
+    """Wrap the ASGI app so statements can be told apart by the route that ran them."""
+
+    async def wrapper(scope, receive, send):
+        if scope["type"] != "http":
+            await app(scope, receive, send)
+            return
+        token = current_route.set(f"{scope['method']} {route_template({**scope, 'app': app})}")
+        try:
+            await app(scope, receive, send)
+        finally:
+            current_route.reset(token)
+
+    return wrapper
+
+
+async def walk_through(client: httpx.AsyncClient, admin_email: str, admin_password: str) -> list[str]:
+    """Send one request to every route, in the ways that change the queries they run.
+
+    Returns:
+        list: Requests that did not succeed, whose queries may not have been recorded
+    """
+    failures = []
+
+    async def send(method, url, expect=(200, 303), **kwargs):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in expect:
+            failures.append(f"{method} {url}: {response.status_code}")
+        return response
+
+    async def token(email, password):
+        response = await send("POST", "/token", data={"username": email, "password": password})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # The anonymous board
+    await send("GET", "/")
+    await send("POST", "/books/", data={"title": "Anonymous", "status": "reading"})
+
+    await send("GET", "/register")
+    await send(
+        "POST",
+        "/register",
+        data={"email": READER_EMAIL, "password": READER_PASSWORD, "confirm_password": READER_PASSWORD},
+    )
+    await send("GET", "/login")
+    await send("POST", "/login", data={"email": READER_EMAIL, "password": READER_PASSWORD})
+    reader = await token(READER_EMAIL, READER_PASSWORD)
+
+    book_ids = []
+    for title, author, status, rating in [
+        ("The Left Hand of Darkness", "Ursula K. Le Guin", "completed", 3),
+        ("Project Hail Mary", "Andy Weir", "reading", None),
+        ("Dune", "Frank Herbert", "to_read", None),
+        ("Ulysses", "James Joyce", "dnf", 0),
+    ]:
+        response = await send(
+            "POST",
+            "/api/books/",
+            json={
+                "title": title,
+                "author": author,
+                "status": status,
+                "rating": rating,
+                "notes": f"Notes on {title}",
+                "start_date": "2024-01-05T00:00:00",
+                "completion_date": "2024-02-10T00:00:00" if status == "completed" else None,
+            },
+            headers=reader,
+        )
+        book_ids.append(response.json()["id"])
+    first, second, *_ = book_ids
+
+    # The board and its fragments, through the login cookie
+    await send("GET", "/")
+    await send("GET", "/add-book")
+    await send("GET", f"/edit-book/{first}")
+    await send("GET", f"/books/{first}")
+    await send("GET", f"/books/{first}?format=card")
+    await send("POST", "/books/", data={"title": "Piranesi", "author": "Susanna Clarke", "status": "to_read"})
+    await send(
+        "POST",
+        "/books/",
+        data={"title": "Middlemarch", "status": "to_read"},
+        headers={"HX-Request": "true", "HX-Target": "add-book-slot"},
+    )
+    await send("PUT", f"/books/{second}", data={"title": "Project Hail Mary", "status": "completed"})
+    await send("PATCH", f"/books/{second}/status", data={"status": "on_hold"}, headers={"HX-Request": "true"})
+    await send("GET", "/profile")
+    await send("GET", "/settings")
+    await send("POST", "/settings/theme", data={"theme_name": "light"})
+
+    # The JSON API, with every filter and a second page
+    page = await send("GET", "/api/books/?limit=2", headers=reader)
+    await send("GET", f"/api/books/?limit=2&cursor={page.json()['next_cursor']}", headers=reader)
+    for query in [
+        "status=completed",
+        "rating=3",
+        "min_rating=1",
+        "author=Ursula%20K.%20Le%20Guin",
+        "started_after=2024-01-01&started_before=2025-01-01",
+        "completed_after=2024-01-01&completed_before=2025-01-01",
+    ]:
+        await send("GET", f"/api/books/?{query}", headers=reader)
+    await send("PUT", f"/api/books/{first}", json={"title": "The Left Hand of Darkness", "status": "completed", "rating": 2}, headers=reader)
+    await send("GET", "/api/books/search?q=dune", headers=reader)
+    await send("GET", "/search?q=le%20guin")
+    await send("GET", "/api/books/export", headers=reader)
+    await send("GET", "/api/books/export?format=csv", headers=reader)
+    await send(
+        "POST",
+        "/api/books/import",
+        files={"file": ("goodreads_library_export.csv", IMPORT_CSV.encode(), "text/csv")},
+        headers=reader,
+    )
+    await send("DELETE", f"/api/books/{book_ids[2]}", headers=reader)
+    await send("DELETE", f"/books/{book_ids[3]}")
+
+    from app import database, models
+
+    with database.SessionLocal() as db:
+        reader_id = db.query(models.User.id).filter(models.User.email == READER_EMAIL).scalar()
+    admin = await token(admin_email, admin_password)
+    await send("GET", "/admin/dashboard", headers=admin)
+    await send("GET", "/admin/users", headers=admin)
+    await send("GET", "/admin/stats", headers=admin)
+    await send("POST", f"/admin/users/{reader_id}/toggle-role", headers=admin)
+    await send("POST", f"/admin/users/{reader_id}/toggle-active", headers=admin)
+    await send("POST", "/admin/counters/reconcile", headers=admin)
+    await send("GET", "/metrics", headers=admin)
+    return failures
+
+
+def explain(connection, statement: str, parameters: tuple) -> list[str]:
+    """Return the EXPLAIN QUERY PLAN detail lines for a recorded statement."""
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return [row[-1] for row in rows]
+
+
+def is_full_scan(detail: str) -> bool:
+    """A plan step is a full table scan if it scans a table without an index."""
+    return (
+        detail.startswith("SCAN ")
+        and " USING " not in detail
+        # FTS5 lookups go through the virtual table's own index
+        and " VIRTUAL TABLE INDEX " not in detail
+        and detail != "SCAN CONSTANT ROW"
+    )
+
+
+async def record_statements(admin_email: str, admin_password: str):
+    """Walk through the routes of an in-process app and record the statements they run."""
+    from app import database
+    from app.main import app
+    from app.middleware import route_template
+
+    recorder = StatementRecorder()
+    recorder.listen(database.engine)
+    recorder.listen(database.async_engine.sync_engine)
+
+    transport = httpx.ASGITransport(app=traced(app, route_template), raise_app_exceptions=False)
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://plans") as client:
+                failures = await walk_through(client, admin_email, admin_password)
+    finally:
+        await database.async_engine.dispose()
+    return recorder.statements, failures
+
+
+def check_query_plans(verbose=False):
+    """
+    Explain every statement the walk-through recorded and report full table scans.
+
+    Returns:
+        list: Routes whose statements fell back to a full table scan, or whose
+        requests failed
+    """
+    temporary = tempfile.TemporaryDirectory(prefix="query-plans-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(temporary.name, 'books.db')}"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    admin_email = os.environ.setdefault("ADMIN_EMAIL", "admin@example.com")
+    admin_password = os.environ.setdefault("ADMIN_PASSWORD", "adminpassword")
+    # The app resolves templates and static files relative to the repository root
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            statements, request_failures = asyncio.run(record_statements(admin_email, admin_password))
+
+        from app import database
+
+        failures = []
+        for request in request_failures:
+            failures.append(request)
+            print(f"FAIL request {request}")
+
+        with database.engine.connect() as connection:
+            for (route, statement), parameters in sorted(statements.items()):
+                plan = explain(connection, statement, parameters)
+                scans = [step for step in plan if is_full_scan(step)]
+                summary = " ".join(statement.split())
+
+                if scans and route not in ALLOWED_FULL_SCANS:
+                    failures.append(route)
+                    print(f"FAIL {route}: {'; '.join(scans)}\n     {summary}")
+                elif verbose:
+                    print(f"ok   {route}: {'; '.join(plan)}\n     {summary}")
+        database.engine.dispose()
+    finally:
+        temporary.cleanup()
+
+    print(f"\nExplained {len(statements)} statements from {len({route for route, _ in statements})} routes")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fail if any query run by the app's routes falls back to a full table scan"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Print the plan of every statement"
+    )
+
+    args = parser.parse_args()
+
+    failures = check_query_plans(verbose=args.verbose)
+    if failures:
+        print(f"{len(failures)} failures")
+    else:
+        print("No unexpected full table scans")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Drive a mix of traffic against the app with N concurrent users and report
+latency percentiles, throughput and error rates per route as JSON.
+
+By default the app is imported and driven in-process through httpx's ASGI
+transport, against a fresh SQLite database in a temporary directory, so
+the numbers show what the application costs without a server or network.
+With --url the same mix runs against a running server over a real socket,
+for example one started with `uvicorn app.main:app --port 8000`.
+
+Each user registers, logs in and adds some books, then repeatedly picks an
+action from the mix: logging in again, loading the board, dragging a book
+to another column, or reading and writing books through the JSON API. The
+admin statistics page is loaded with a separate admin session.
+
+Save the JSON of a run and pass it to --compare on a later run to see how
+each route changed:
+
+    python scripts/load_test.py --users 20 --duration 30 --output before.json
+    python scripts/load_test.py --users 20 --duration 30 --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", "admin@example.com")
+ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "adminpassword")
+
+USER_PASSWORD = "loadtest-password"
+STATUSES = ["to_read", "reading", "completed", "on_hold", "dnf"]
+
+# Relative weight of each action in the default traffic mix
+DEFAULT_MIX = {
+    "home": 30,
+    "patch_status": 20,
+    "api_list": 15,
+    "api_create": 8,
+    "api_update": 8,
+    "api_delete": 6,
+    "login": 5,
+    "admin_stats": 3,
+}
+
+
+class Recorder:
+    """Collects the latency and outcome of every request by route."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def record(self, route, elapsed, status, ok):
+        if not self.recording:
+            return
+        self.latencies[route].append(elapsed)
+        self.statuses[route][str(status)] += 1
+        if not ok:
+            self.errors[route] += 1
+
+
+class User:
+    """One simulated user with its own cookies, API token and books."""
+
+    def __init__(self, client, recorder, email, rng, password=USER_PASSWORD):
+        self.client = client
+        self.recorder = recorder
+        self.email = email
+        self.password = password
+        self.rng = rng
+        self.headers = {}
+        self.book_ids = []
+        self.initial_books = 0
+        self.etag = None
+
+    async def request(self, route, method, url, expected=(200,), **kwargs):
+        """Send a request, record it under route and return the response, or None on failure."""
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(route, time.perf_counter() - started, type(e).__name__, False)
+            return None
+        elapsed = time.perf_counter() - started
+        ok = response.status_code in expected
+        self.recorder.record(route, elapsed, response.status_code, ok)
+        return response if ok else None
+
+    async def register(self):
+        await self.request(
+            "POST /register",
+            "POST",
+            "/register",
+            expected=(303,),
+            data={"email": self.email, "password": self.password, "confirm_password": self.password},
+        )
+        await self.login()
+        response = await self.request(
+            "POST /token", "POST", "/token", data={"username": self.email, "password": self.password}
+        )
+        if response is None:
+            raise RuntimeError(f"Could not get an API token for {self.email}")
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def add_books(self, count):
+        for _ in range(count):
+            await self.api_create()
+        self.initial_books = len(self.book_ids)
+
+    def random_book(self):
+        return {
+            "title": f"Load test book {self.rng.randrange(1_000_000)}",
+            "author": f"Author {self.rng.randrange(50)}",
+            "status": self.rng.choice(STATUSES),
+            "notes": "Written by scripts/load_test.py",
+            "rating": self.rng.choice([None, 0, 1, 2, 3]),
+        }
+
+    async def login(self):
+        await self.request(
+            "POST /login",
+            "POST",
+            "/login",
+            expected=(303,),
+            data={"email": self.email, "password": self.password},
+        )
+
+    async def home(self):
+        # Revalidate like a browser holding the previous board
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        response = await self.request("GET /", "GET", "/", expected=(200, 304), headers=headers)
+        if response is not None and response.status_code == 200:
+            self.etag = response.headers.get("etag")
+
+    async def patch_status(self):
+        if not self.book_ids:
+            return await self.api_create()
+        book_id = self.rng.choice(self.book_ids)
+        await self.request(
+            "PATCH /books/{id}/status",
+            "PATCH",
+            f"/books/{book_id}/status",
+            data={"status": self.rng.choice(STATUSES)},
+        )
+
+    async def api_list(self):
+        await self.request("GET /api/books/", "GET", "/api/books/", headers=self.headers)
+
+    async def api_create(self):
+        response = await self.request(
+            "POST /api/books/", "POST", "/api/books/", json=self.random_book(), headers=self.headers
+        )
+        if response is not None:
+            self.book_ids.append(response.json()["id"])
+
+    async def api_update(self):
+        if not self.book_ids:
+            return await self.api_create()
+        book_id = self.rng.choice(self.book_ids)
+        await self.request(
+            "PUT /api/books/{id}",
+            "PUT",
+            f"/api/books/{book_id}",
+            json=self.random_book(),
+            headers=self.headers,
+        )
+
+    async def api_delete(self):
+        # Only delete books added during the run, so the board keeps its size
+        if len(self.book_ids) <= self.initial_books:
+            return await self.api_create()
+        book_id = self.book_ids.pop()
+        await self.request(
+            "DELETE /api/books/{id}", "DELETE", f"/api/books/{book_id}", headers=self.headers
+        )
+
+
+class Admin(User):
+    async def admin_stats(self):
+        await self.request("GET /admin/stats", "GET", "/admin/stats")
+
+
+def parse_mix(value):
+    """Parse "home=10,login=0" into weights on top of the default mix."""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, value.split(",")):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(
+                f"Unknown action '{name}', expected one of: {', '.join(DEFAULT_MIX)}"
+            )
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("The mix needs at least one action with a weight")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, statuses, elapsed):
+    count = len(latencies)
+    values = sorted(latencies)
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None  # noqa: E731
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": to_ms(percentile(values, 0.50)),
+            "p95": to_ms(percentile(values, 0.95)),
+            "p99": to_ms(percentile(values, 0.99)),
+            "mean": to_ms(sum(values) / count) if count else None,
+            "max": to_ms(values[-1]) if values else None,
+        },
+        "statuses": dict(statuses),
+    }
+
+
+def build_report(recorder, elapsed, config):
+    routes = {
+        route: summarize(latencies, recorder.errors[route], recorder.statuses[route], elapsed)
+        for route, latencies in sorted(recorder.latencies.items())
+    }
+    all_latencies = [value for latencies in recorder.latencies.values() for value in latencies]
+    statuses = defaultdict(int)
+    for route_statuses in recorder.statuses.values():
+        for status, count in route_statuses.items():
+            statuses[status] += count
+    return {
+        "config": config,
+        "started_at": config.pop("started_at"),
+        "duration_s": round(elapsed, 3),
+        "total": summarize(all_latencies, sum(recorder.errors.values()), statuses, elapsed),
+        "routes": routes,
+    }
+
+
+def print_summary(report, baseline=None, file=sys.stderr):
+    """Print a table of the report, with the change from a baseline report if given."""
+    header = f"{'route':<28} {'requests':>9} {'rps':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    if baseline:
+        header += f" {'p95 change':>11} {'rps change':>11}"
+    print(header, file=file)
+    rows = list(report["routes"].items()) + [("total", report["total"])]
+    for route, stats in rows:
+        latency = stats["latency_ms"]
+        line = (
+            f"{route:<28} {stats['requests']:>9} {stats['throughput_rps']:>9.1f} "
+            f"{stats['error_rate']:>7.1%} {latency['p50'] or 0:>9.2f} "
+            f"{latency['p95'] or 0:>9.2f} {latency['p99'] or 0:>9.2f}"
+        )
+        if baseline:
+            before = baseline["total"] if route == "total" else baseline["routes"].get(route)
+            if before and before["latency_ms"]["p95"] and before["throughput_rps"]:
+                p95_change = latency["p95"] / before["latency_ms"]["p95"] - 1
+                rps_change = stats["throughput_rps"] / before["throughput_rps"] - 1
+                line += f" {p95_change:>+11.1%} {rps_change:>+11.1%}"
+            else:
+                line += f" {'new':>11} {'new':>11}"
+        print(line, file=file)
+
+
+async def user_loop(user, admin, mix, deadline):
+    actions = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in actions]
+    while time.perf_counter() < deadline:
+        action = user.rng.choices(actions, weights)[0]
+        if action == "admin_stats":
+            if admin is not None:
+                await admin.admin_stats()
+            continue
+        await getattr(user, action)()
+
+
+async def run(args, client_factory):
+    """Set up the users, run the mix for the configured duration and return the report."""
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    clients = []
+
+    def new_client():
+        client = client_factory()
+        clients.append(client)
+        return client
+
+    try:
+        admin = None
+        if args.mix["admin_stats"] > 0:
+            admin = Admin(
+                new_client(), recorder, args.admin_email, random.Random(rng.random()), args.admin_password
+            )
+            await admin.login()
+            if "access_token" not in admin.client.cookies:
+                print(
+                    f"Could not log in as admin {args.admin_email}, skipping admin traffic",
+                    file=sys.stderr,
+                )
+                admin = None
+
+        users = [
+            User(new_client(), recorder, f"loadtest-{run_id}-{i}@example.com", random.Random(rng.random()))
+            for i in range(args.users)
+        ]
+        print(f"Registering {len(users)} users with {args.books} books each...", file=sys.stderr)
+        await asyncio.gather(*(user.register() for user in users))
+        await asyncio.gather(*(user.add_books(args.books) for user in users))
+
+        if args.warmup:
+            print(f"Warming up for {args.warmup}s...", file=sys.stderr)
+            await asyncio.gather(
+                *(user_loop(u, admin, args.mix, time.perf_counter() + args.warmup) for u in users)
+            )
+
+        print(f"Running for {args.duration}s...", file=sys.stderr)
+        recorder.recording = True
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(user_loop(u, admin, args.mix, started + args.duration) for u in users)
+        )
+        elapsed = time.perf_counter() - started
+        recorder.recording = False
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    config = {
+        "target": args.url or "in-process",
+        "users": args.users,
+        "books_per_user": args.books,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "seed": args.seed,
+        "mix": args.mix,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+    return build_report(recorder, elapsed, config)
+
+
+async def run_in_process(args):
+    """Import the app against a temporary database and drive it through ASGI."""
+    temporary = None
+    if not args.database_url:
+        temporary = tempfile.TemporaryDirectory(prefix="load-test-")
+        args.database_url = f"sqlite:///{os.path.join(temporary.name, 'books.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+    # The app's startup creates the schema and this admin user
+    os.environ["ADMIN_EMAIL"] = args.admin_email
+    os.environ["ADMIN_PASSWORD"] = args.admin_password
+    # The app resolves templates and static files relative to the repository root
+    os.chdir(ROOT)
+
+    from app import database
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    try:
+        # Keep anything the app prints out of the JSON report on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            async with app.router.lifespan_context(app):
+                return await run(
+                    args,
+                    lambda: httpx.AsyncClient(
+                        transport=transport, base_url="http://loadtest", timeout=args.timeout
+                    ),
+                )
+    finally:
+        await database.async_engine.dispose()
+        database.engine.dispose()
+        if temporary is not None:
+            temporary.cleanup()
+
+
+async def run_over_socket(args):
+    """Drive a running server over HTTP."""
+    return await run(
+        args,
+        lambda: httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the app and report latency percentiles per route as JSON"
+    )
+    parser.add_argument("--url", help="Base URL of a running server; the app runs in-process if omitted")
+    parser.add_argument("--users", type=int, default=10, help="Number of concurrent users")
+    parser.add_argument("--books", type=int, default=20, help="Books each user adds before the run")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured traffic")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of unmeasured traffic first")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=dict(DEFAULT_MIX),
+        help="Action weights to override, e.g. home=10,login=0 "
+        f"(actions: {', '.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the choice of actions")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout in seconds")
+    parser.add_argument("--admin-email", default=ADMIN_EMAIL, help="Admin used for the admin stats page")
+    parser.add_argument("--admin-password", default=ADMIN_PASSWORD, help="Password of the admin")
+    parser.add_argument(
+        "--database-url",
+        help="Database for an in-process run (default: a new SQLite file in a temporary directory)",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+
+    args = parser.parse_args()
+
+    report = asyncio.run(run_over_socket(args) if args.url else run_in_process(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_summary(report, baseline)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 1 if report["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,21 @@
 #!/usr/bin/env python3
+"""
+Populate the database with books.
+
+By default ten sample books are added for the admin user through the API
+of a running server. With --generate, a large synthetic dataset of users
+and books is written straight to the database with bulk inserts instead,
+for benchmarks and load tests that need a known, large fixture.
+"""
 from datetime import datetime, timedelta
+from itertools import accumulate
 import httpx
 import asyncio
 import argparse
 import os
+import random
+import sys
+import time
 
 # Admin credentials (can be overridden with command line arguments)
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", "admin@example.com")
@@ -125,10 +137,19 @@ async def populate_db(
             # Set authorization header for all subsequent requests
             headers = {"Authorization": f"Bearer {token}"}
 
-            # Get existing books for the admin user
-            response = await client.get(f"{api_url}/books/", headers=headers)
-            response.raise_for_status()
-            existing_books = response.json()
+            # Get existing books for the admin user, one page at a time
+            existing_books = []
+            params = {}
+            while True:
+                response = await client.get(
+                    f"{api_url}/books/", params=params, headers=headers
+                )
+                response.raise_for_status()
+                page = response.json()
+                existing_books.extend(page["items"])
+                if not page["next_cursor"]:
+                    break
+                params["cursor"] = page["next_cursor"]
 
             # Delete existing books
             for book in existing_books:
@@ -153,6 +174,234 @@ async def populate_db(
             print(f"Make sure the application is running on {base_url}")
 
 
+# Synthetic dataset: words that generated titles, authors and notes are made of
+TITLE_WORDS = [
+    "Shadow", "Empire", "Garden", "River", "Silent", "Glass", "Winter", "Iron", "Last",
+    "Hidden", "City", "Stars", "Memory", "Ocean", "Fire", "Crown", "Night", "Machine",
+    "Forest", "Storm", "House", "Secret", "Light", "Bone", "Paper", "Distant", "Broken",
+    "Golden", "Song", "Road", "Mirror", "Kingdom", "Wolf", "Salt", "Ash", "Dream",
+    "Station", "Harbor", "Library", "Orchard", "Signal", "Tide", "Lantern", "Frontier",
+]
+FIRST_NAMES = [
+    "Ada", "Ben", "Chen", "Dana", "Elif", "Farah", "Gabriel", "Hana", "Ivan", "Jun",
+    "Kofi", "Lena", "Mateo", "Nadia", "Omar", "Priya", "Quinn", "Rosa", "Sven", "Tomas",
+    "Uma", "Viktor", "Wen", "Ximena", "Yusuf", "Zoe", "Amara", "Bruno", "Carmen", "Dmitri",
+]
+LAST_NAMES = [
+    "Okafor", "Lindqvist", "Tanaka", "Moreau", "Kowalski", "Haddad", "Novak", "Silva",
+    "Oyelaran", "Fischer", "Nakamura", "Rossi", "Abernathy", "Castellanos", "Ivanova",
+    "Park", "Mbeki", "Larsen", "Quispe", "Varga", "Whitfield", "Yilmaz", "Zhang", "Brennan",
+    "Duarte", "Eriksen", "Gallagher", "Horvat", "Iqbal", "Jovanovic", "Kaur", "Lemaire",
+]
+NOTE_SENTENCES = [
+    "The opening chapters took a while to find their rhythm.",
+    "I kept thinking about the ending for days afterwards.",
+    "The world-building is dense but rewards close reading.",
+    "Some of the secondary characters deserved more pages.",
+    "A slow burn that pays off in the final third.",
+    "The prose is spare and precise, almost clinical at times.",
+    "I read most of it in one sitting on a long train ride.",
+    "The middle section drags, but the last act is superb.",
+    "Recommended to me by a friend and it did not disappoint.",
+    "The dialogue feels natural and often very funny.",
+    "Several timelines are woven together with real skill.",
+    "I had to look up a lot of the historical background.",
+    "The translation reads smoothly and keeps the original voice.",
+    "A quieter book than I expected, and better for it.",
+    "The twist was signposted early, which made it less effective.",
+    "Beautifully structured, with every chapter earning its place.",
+    "I want to reread it now that I know how it ends.",
+    "It raises more questions than it answers, deliberately so.",
+    "The audiobook narration added a lot to the experience.",
+    "Not my usual genre, but it won me over.",
+]
+
+# Share of books in each status, and the ratings given to books in each status
+STATUS_WEIGHTS = {"to_read": 35, "completed": 38, "reading": 10, "on_hold": 9, "dnf": 8}
+RATING_WEIGHTS = {
+    "to_read": {None: 100},
+    "reading": {None: 80, 2: 8, 3: 12},
+    "completed": {None: 12, 1: 10, 2: 33, 3: 45},
+    "on_hold": {None: 85, 1: 5, 2: 10},
+    "dnf": {0: 85, None: 15},
+}
+NOTES_SHARE = 0.45
+NOTES_POOL_SIZE = 2000
+
+# Generated dates lie before this day, so a seed always gives the same dataset
+REFERENCE_DATE = datetime(2025, 1, 1)
+
+# Every generated user can log in with this password
+GENERATED_PASSWORD = "password"
+
+
+class DatasetGenerator:
+    """Seeded source of synthetic users and books, reproducible for a given seed."""
+
+    def __init__(self, seed, authors=5000):
+        self.rng = random.Random(seed)
+        rng = self.rng
+        # Cumulative weights, so each draw is a bisect rather than a sum over the weights
+        self.statuses = list(STATUS_WEIGHTS)
+        self.status_weights = list(accumulate(STATUS_WEIGHTS.values()))
+        self.ratings = {
+            status: (list(weights), list(accumulate(weights.values())))
+            for status, weights in RATING_WEIGHTS.items()
+        }
+        # A few authors are very popular and most have a handful of books
+        self.authors = [
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(authors)
+        ]
+        self.author_weights = list(accumulate(1 / (rank + 1) for rank in range(authors)))
+        # Notes are drawn from a pool, from a single sentence to a long review
+        self.notes = [
+            " ".join(rng.choices(NOTE_SENTENCES, k=max(1, int(rng.expovariate(1 / 6)))))
+            for _ in range(NOTES_POOL_SIZE)
+        ]
+
+    def books_per_user(self, users, books):
+        """Split books over users with a long tail: most have a few, some have thousands."""
+        weights = [self.rng.paretovariate(1.2) for _ in range(users)]
+        total = sum(weights)
+        counts = [int(weight / total * books) for weight in weights]
+        # Hand out the books lost to rounding down
+        for index in self.rng.sample(range(users), books - sum(counts)):
+            counts[index] += 1
+        return counts
+
+    def user(self, email, hashed_password):
+        return {
+            "email": email,
+            "hashed_password": hashed_password,
+            "is_active": True,
+            "role": "user",
+            "created_at": REFERENCE_DATE - timedelta(seconds=self.rng.randrange(3 * 365 * 86400)),
+        }
+
+    def book(self, user_id):
+        rng = self.rng
+        status = rng.choices(self.statuses, cum_weights=self.status_weights)[0]
+        ratings, rating_weights = self.ratings[status]
+
+        start_date = completion_date = None
+        if status != "to_read":
+            start_date = REFERENCE_DATE - timedelta(seconds=rng.randrange(5 * 365 * 86400))
+        if status == "completed":
+            days = min(rng.lognormvariate(3, 0.8), 365)
+            completion_date = min(start_date + timedelta(days=days), REFERENCE_DATE)
+
+        words = rng.sample(TITLE_WORDS, rng.randint(1, 4))
+        title = " ".join(["The"] + words if rng.random() < 0.3 else words)
+        return {
+            "title": title,
+            "author": rng.choices(self.authors, cum_weights=self.author_weights)[0],
+            "status": status,
+            "notes": rng.choice(self.notes) if rng.random() < NOTES_SHARE else None,
+            "start_date": start_date,
+            "completion_date": completion_date,
+            "rating": rng.choices(ratings, cum_weights=rating_weights)[0],
+            "user_id": user_id,
+            "version": 1,
+        }
+
+
+def generate_dataset(users, books, seed, batch_size, email_prefix="user", force=False):
+    """Write users and their books straight to the database with bulk inserts.
+
+    The schema is created or migrated the way app startup does it. Books are
+    inserted without the full-text search triggers, and the search index is
+    rebuilt in one pass afterwards. The counters are recounted and the
+    generated users' library versions bumped at the end; reading summaries
+    are rebuilt when first used.
+
+    The app must not be running against the same database: it would miss
+    search index updates while the triggers are gone, and write counters
+    that the recount then overwrites.
+    """
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sqlalchemy import insert, select
+    from app import auth, counters, database, models, search, startup
+
+    engine = database.engine
+    startup.migrate_schema()
+    generator = DatasetGenerator(seed)
+    emails = [f"{email_prefix}{i}@example.com" for i in range(users)]
+
+    with database.SessionLocal() as db:
+        if not force and (db.query(models.User.id).first() or db.query(models.Book.id).first()):
+            print(
+                f"{engine.url.render_as_string(hide_password=True)} already has data. "
+                "Stop the app and pass --force to add the generated dataset to it."
+            )
+            return False
+        if db.query(models.User.id).filter(models.User.email.in_(emails[:1])).first():
+            print(f"{emails[0]} already exists, pick another --email-prefix")
+            return False
+
+    started = time.perf_counter()
+    hashed_password = auth.get_password_hash(GENERATED_PASSWORD)
+    search.drop_search_index(engine)
+
+    with engine.connect() as connection:
+        if engine.dialect.name == "sqlite":
+            # A crash mid-load only loses generated data, so skip the fsyncs
+            connection.exec_driver_sql("PRAGMA synchronous = OFF")
+
+        for offset in range(0, users, batch_size):
+            connection.execute(
+                insert(models.User.__table__),
+                [generator.user(email, hashed_password) for email in emails[offset:offset + batch_size]],
+            )
+        connection.commit()
+        user_ids = {}
+        for offset in range(0, users, 500):
+            user_ids.update(
+                connection.execute(
+                    select(models.User.email, models.User.id).where(
+                        models.User.email.in_(emails[offset:offset + 500])
+                    )
+                ).all()
+            )
+        print(f"Inserted {users} users in {time.perf_counter() - started:.1f}s")
+
+        phase = time.perf_counter()
+        batch = []
+        inserted = 0
+        for email, count in zip(emails, generator.books_per_user(users, books)):
+            user_id = user_ids[email]
+            for _ in range(count):
+                batch.append(generator.book(user_id))
+                if len(batch) >= batch_size:
+                    connection.execute(insert(models.Book.__table__), batch)
+                    connection.commit()
+                    inserted += len(batch)
+                    batch.clear()
+                    print(f"  {inserted}/{books} books", end="\r", flush=True)
+        if batch:
+            connection.execute(insert(models.Book.__table__), batch)
+            connection.commit()
+        print(f"Inserted {books} books in {time.perf_counter() - phase:.1f}s")
+
+    phase = time.perf_counter()
+    search.ensure_search_index(engine)
+    print(f"Built the search index in {time.perf_counter() - phase:.1f}s")
+
+    phase = time.perf_counter()
+    with database.SessionLocal() as db:
+        counters.reconcile(db)
+        # Clients revalidate cached boards against these versions
+        counters.record_libraries_changed(db, user_ids.values())
+        db.commit()
+    print(f"Recounted the counters in {time.perf_counter() - phase:.1f}s")
+
+    print(
+        f"\nGenerated {users} users and {books} books with seed {seed} "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    print(f"Users are {emails[0]} to {emails[-1]}, password '{GENERATED_PASSWORD}'")
+    return True
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Populate the database with sample books for the admin user"
@@ -170,7 +419,42 @@ if __name__ == "__main__":
         default="http://localhost:8082",
         help="Base URL of the application (default: http://localhost:8082)",
     )
+    generate = parser.add_argument_group(
+        "synthetic dataset",
+        "Write a large generated dataset straight to the database set by DATABASE_URL",
+    )
+    generate.add_argument(
+        "--generate", action="store_true", help="Generate users and books instead"
+    )
+    generate.add_argument(
+        "--users", type=int, default=10000, help="Users to generate (default: 10000)"
+    )
+    generate.add_argument(
+        "--books", type=int, default=1000000, help="Books to generate (default: 1000000)"
+    )
+    generate.add_argument(
+        "--seed", type=int, default=0, help="Random seed; a seed always gives the same data"
+    )
+    generate.add_argument(
+        "--batch-size", type=int, default=10000, help="Rows per insert (default: 10000)"
+    )
+    generate.add_argument(
+        "--force",
+        action="store_true",
+        help="Generate into a database that already has users or books",
+    )
+    generate.add_argument(
+        "--email-prefix",
+        default="user",
+        help="Generated users are <prefix><n>@example.com (default: user)",
+    )
 
     args = parser.parse_args()
 
+    if args.generate:
+        success = generate_dataset(
+            args.users, args.books, args.seed, args.batch_size, args.email_prefix, args.force
+        )
+        sys.exit(0 if success else 1)
+
     asyncio.run(populate_db(args.email, args.password, args.url))